@@ -3,6 +3,8 @@ from django.contrib import admin
 # Register your models here.
 from .models import Post
 from .models import Group
+from .models import Job
+from . import jobs
 
 class PostAdmin(admin.ModelAdmin):
     list_display = ("text", "pub_date", "author") 
@@ -16,5 +18,17 @@ class GroupAdmin(admin.ModelAdmin):
     prepopulated_fields = {"slug": ("title",)}
     empty_value_display = "-пусто-"
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("name", "status", "attempts", "run_at", "locked_by")
+    list_filter = ("status", "name")
+    readonly_fields = ("last_error", "created", "finished")
+    actions = ("retry",)
+
+    def retry(self, request, queryset):
+        count = jobs.retry(queryset)
+        self.message_user(request, "Возвращено в очередь: %d" % count)
+    retry.short_description = "Перезапустить задачи"
+
 admin.site.register(Post, PostAdmin)
-admin.site.register(Group, GroupAdmin)
\ No newline at end of file
+admin.site.register(Group, GroupAdmin)
+admin.site.register(Job, JobAdmin)
\ No newline at end of file
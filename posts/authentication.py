@@ -0,0 +1,45 @@
+"""Аутентификация по токену с кэшем.
+
+`TokenAuthentication` на каждый запрос к API выбирает токен вместе с
+пользователем. Здесь токен с уже загруженным пользователем хранится в
+кэше `AUTH_TOKEN_CACHE_TIMEOUT` секунд. Сигналы (posts/signals.py)
+удаляют запись при удалении или замене токена и при сохранении
+пользователя, в том числе при его деактивации; изменения через
+`QuerySet.update()` сигналов не шлют и доживают до конца таймаута.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+KEY_PREFIX = 'authtoken'
+
+
+def cache_key(key):
+    # сам токен в ключ кэша не попадает
+    return '%s:%s' % (KEY_PREFIX, hashlib.sha1(key.encode()).hexdigest())
+
+
+def forget(*keys):
+    cache.delete_many([cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        token = cache.get(cache_key(key))
+        if token is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user').get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            cache.set(cache_key(key), token,
+                      settings.AUTH_TOKEN_CACHE_TIMEOUT)
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return (token.user, token)
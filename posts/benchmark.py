@@ -0,0 +1,305 @@
+"""Нагрузочный бенчмарк.
+
+`seed` заполняет базу синтетическими данными, `build_mix` составляет
+взвешенную смесь запросов к лентам и API (её можно сохранить в JSONL
+и потом проиграть снова), `replay` прогоняет запросы через WSGI-обработчик
+тестового клиента, `report` считает перцентили задержки, число
+SQL-запросов на запрос и пиковый RSS процесса.
+"""
+import json
+import math
+import random
+import resource
+import subprocess
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.contrib.auth.hashers import make_password
+from django.db import connections
+from django.test import Client
+from rest_framework.authtoken.models import Token
+
+from . import comments as post_comments, counters, fastjson, search, timeline
+from .models import Comment, Follow, Group, Post, User
+from .serializers import PostSerializer
+
+# сценарий -> вес в смеси по умолчанию
+DEFAULT_MIX = {
+    'index': 30,
+    'group_posts': 15,
+    'profile': 15,
+    'post_view': 20,
+    'follow_index': 10,
+    'api_posts': 7,
+    'api_post_detail': 3,
+}
+# сценарии, которым нужен вошедший пользователь
+AUTH_SCENARIOS = {'follow_index', 'api_posts', 'api_post_detail'}
+
+WORDS = (
+    'город', 'река', 'утро', 'книга', 'дорога', 'музыка', 'снег', 'кофе',
+    'поезд', 'море', 'лес', 'письмо', 'окно', 'праздник', 'работа', 'кот',
+    'фильм', 'ветер', 'дом', 'вечер', 'друг', 'песня', 'поход', 'чай',
+)
+BATCH_SIZE = 500
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def seed(users=50, groups=5, posts=1000, follows=200, comments=1000,
+         rng=None):
+    """Синтетические данные. `bulk_create` обходит сигналы, поэтому
+    ленты, счётчики и поисковый индекс потом пересобираются целиком."""
+    rng = rng or random.Random(0)
+    password = make_password(None)
+    User.objects.bulk_create(
+        [User(username='bench%d' % i, first_name='Автор%d' % i,
+              password=password) for i in range(users)],
+        batch_size=BATCH_SIZE)
+    user_ids = list(User.objects.filter(
+        username__startswith='bench').values_list('pk', flat=True))
+
+    Group.objects.bulk_create(
+        [Group(title='Группа %d' % i, slug='bench-%d' % i,
+               description=_text(rng, 10)) for i in range(groups)])
+    group_ids = list(Group.objects.filter(
+        slug__startswith='bench-').values_list('pk', flat=True))
+
+    Post.objects.bulk_create(
+        [Post(text=_text(rng, rng.randint(5, 60)),
+              author_id=rng.choice(user_ids),
+              group_id=rng.choice(group_ids + [None]) if group_ids else None)
+         for _ in range(posts)],
+        batch_size=BATCH_SIZE)
+    post_ids = list(Post.objects.filter(
+        author_id__in=user_ids).values_list('pk', flat=True))
+
+    pairs = set()
+    attempts = 0
+    while len(pairs) < follows and attempts < follows * 10 and len(user_ids) > 1:
+        attempts += 1
+        user_id, author_id = rng.sample(user_ids, 2)
+        pairs.add((user_id, author_id))
+    Follow.objects.bulk_create(
+        [Follow(user_id=user_id, author_id=author_id)
+         for user_id, author_id in pairs], batch_size=BATCH_SIZE)
+
+    if post_ids:
+        Comment.objects.bulk_create(
+            [Comment(post_id=rng.choice(post_ids),
+                     author_id=rng.choice(user_ids),
+                     text=_text(rng, rng.randint(3, 20)))
+             for _ in range(comments)],
+            batch_size=BATCH_SIZE)
+        post_comments.fill_paths()
+
+    timeline.rebuild(user_ids)
+    counters.recount(user_ids)
+    if search.available():
+        search.rebuild()
+    return {'users': len(user_ids), 'groups': len(group_ids),
+            'posts': len(post_ids), 'follows': len(pairs),
+            'comments': comments if post_ids else 0}
+
+
+def build_mix(count, mix=None, rng=None):
+    """Список запросов `{'name', 'path', 'user'}` по весам `mix`."""
+    rng = rng or random.Random(0)
+    mix = mix or DEFAULT_MIX
+    usernames = list(User.objects.filter(
+        username__startswith='bench').values_list('username', flat=True))
+    slugs = list(Group.objects.values_list('slug', flat=True))
+    posts = list(Post.objects.values_list('author__username', 'pk'))
+    if not usernames or not posts:
+        raise ValueError('Нет данных для бенчмарка, сначала вызовите seed()')
+    names = [name for name in mix if mix[name] > 0
+             and (slugs or name != 'group_posts')]
+    weights = [mix[name] for name in names]
+
+    requests = []
+    for name in rng.choices(names, weights, k=count):
+        user = rng.choice(usernames) if name in AUTH_SCENARIOS else None
+        author, post_id = rng.choice(posts)
+        if name == 'index':
+            path = '/'
+        elif name == 'group_posts':
+            path = '/group/%s/' % rng.choice(slugs)
+        elif name == 'profile':
+            path = '/%s/' % author
+        elif name == 'post_view':
+            path = '/%s/%d/' % (author, post_id)
+        elif name == 'follow_index':
+            path = '/follow/'
+        elif name == 'api_posts':
+            path = '/api/v1/posts/'
+        elif name == 'api_post_detail':
+            path = '/api/v1/posts/%d/' % post_id
+        else:
+            raise ValueError('Неизвестный сценарий: %s' % name)
+        requests.append({'name': name, 'path': path, 'user': user})
+    return requests
+
+
+def save_jsonl(requests, path):
+    with open(path, 'w', encoding='utf-8') as out:
+        for item in requests:
+            out.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+
+def load_jsonl(path):
+    with open(path, encoding='utf-8') as source:
+        return [json.loads(line) for line in source if line.strip()]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Replayer:
+    """Клиенты по пользователям: сессия для страниц, токен для API.
+    Вход выполняется до замеров."""
+
+    def __init__(self):
+        self.clients = {}
+
+    def client(self, item):
+        user, api = item.get('user'), item['path'].startswith('/api/')
+        key = (user, api)
+        if key not in self.clients:
+            if user is None:
+                client = Client()
+            elif api:
+                token = Token.objects.get_or_create(
+                    user=User.objects.get(username=user))[0]
+                client = Client(HTTP_AUTHORIZATION='Token %s' % token.key)
+            else:
+                client = Client()
+                client.force_login(User.objects.get(username=user))
+            self.clients[key] = client
+        return self.clients[key]
+
+    def run(self, requests):
+        for item in requests:
+            self.client(item)
+        samples = []
+        for item in requests:
+            client = self.client(item)
+            counter = QueryCounter()
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(counter))
+                start = time.perf_counter()
+                response = client.get(item['path'])
+                if getattr(response, 'streaming', False):
+                    b''.join(response.streaming_content)
+                duration = time.perf_counter() - start
+            samples.append({
+                'name': item['name'], 'status': response.status_code,
+                'seconds': duration, 'queries': counter.count})
+        return samples
+
+
+def replay(requests, warmup=0):
+    replayer = Replayer()
+    if warmup:
+        replayer.run(requests[:warmup])
+    return replayer.run(requests)
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def _summary(samples):
+    seconds = [sample['seconds'] for sample in samples]
+    queries = [sample['queries'] for sample in samples]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if sample['status'] >= 400),
+        'p50_ms': percentile(seconds, 50) * 1000,
+        'p95_ms': percentile(seconds, 95) * 1000,
+        'p99_ms': percentile(seconds, 99) * 1000,
+        'queries_mean': sum(queries) / len(queries),
+        'queries_max': max(queries),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(samples, dataset=None):
+    by_name = defaultdict(list)
+    for sample in samples:
+        by_name[sample['name']].append(sample)
+    return {
+        'revision': git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'dataset': dataset,
+        # ru_maxrss в Linux — в килобайтах
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'total': _summary(samples) if samples else None,
+        'views': {name: _summary(items)
+                  for name, items in sorted(by_name.items())},
+    }
+
+
+def compare(old, new, metric='p95_ms'):
+    """(сценарий, было, стало, отношение) по общим сценариям."""
+    rows = []
+    for name, stats in sorted(new['views'].items()):
+        before = old['views'].get(name)
+        if before and before[metric]:
+            rows.append((name, before[metric], stats[metric],
+                         stats[metric] / before[metric]))
+    return rows
+
+
+def serialization(page_size=100, repeat=20):
+    """Страница API через `PostSerializer` + `JSONRenderer` против
+    быстрого пути `fastjson`: медиана времени и ускорение."""
+    from rest_framework.renderers import JSONRenderer
+
+    def slow():
+        posts = PostSerializer.prepare_queryset(Post.objects.all())
+        return JSONRenderer().render(PostSerializer(
+            list(posts[:page_size]), many=True).data)
+
+    def fast():
+        rows = list(fastjson.values(Post.objects.all())[:page_size])
+        return fastjson.dumps(fastjson.items(rows))
+
+    timings = {}
+    for name, func in (('serializer', slow), ('fastjson', fast)):
+        func()
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+        timings[name] = percentile(samples, 50) * 1000
+    return {
+        'page_size': page_size,
+        'encoder': 'orjson' if fastjson.orjson is not None else 'json',
+        'serializer_ms': timings['serializer'],
+        'fastjson_ms': timings['fastjson'],
+        'speedup': timings['serializer'] / timings['fastjson'],
+    }
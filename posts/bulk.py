@@ -0,0 +1,133 @@
+"""Пакетная загрузка, правка и удаление постов через API.
+
+`bulk_create` и `bulk_update` не отправляют сигналы, поэтому ленты
+подписчиков, счётчики, поисковый индекс и поколения кэша обновляются
+здесь одним проходом на всю пачку. Живая лента (posts/live.py) о
+загруженных пачкой постах не оповещается.
+"""
+from django.db import transaction
+from django.db.models import Max
+from rest_framework.exceptions import ValidationError
+
+from . import caching, counters, search, timeline
+from .models import Post
+from .serializers import PostBulkSerializer
+
+BATCH_SIZE = 500
+
+
+def _error(index, errors):
+    return {'index': index, 'status': 'error', 'errors': errors}
+
+
+def save(user, items):
+    """Создаёт посты без `id` и обновляет посты с `id`. Неверные элементы
+    пропускаются, остальные пишутся одной транзакцией. Возвращает
+    результаты в порядке элементов."""
+    results = [None] * len(items)
+    creates, updates = [], []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = _error(index, {'non_field_errors': [
+                'Expected an object.']})
+        elif item.get('id') is None:
+            creates.append(index)
+        else:
+            updates.append(index)
+
+    with transaction.atomic():
+        _create(user, items, creates, results)
+        _update(user, items, updates, results)
+    return results
+
+
+def _validated(items, indexes, results, partial=False):
+    # как ListSerializer.to_internal_value, но ошибка одного элемента
+    # не отменяет остальные
+    child = PostBulkSerializer(many=True, partial=partial).child
+    valid = []
+    for index in indexes:
+        try:
+            valid.append((index, child.run_validation(items[index])))
+        except ValidationError as error:
+            results[index] = _error(index, error.detail)
+    return valid
+
+
+def _create(user, items, indexes, results):
+    valid = _validated(items, indexes, results)
+    if not valid:
+        return
+    last_pk = Post.objects.aggregate(last=Max('pk'))['last'] or 0
+    posts = Post.objects.bulk_create(
+        [Post(author=user, **data) for index, data in valid],
+        batch_size=BATCH_SIZE)
+    if posts[0].pk is None:
+        # первичные ключи после bulk_create возвращает только PostgreSQL;
+        # в SQLite транзакция держит запись, новые id идут подряд
+        pks = Post.objects.filter(author=user, pk__gt=last_pk).order_by(
+            'pk').values_list('pk', flat=True)
+        for post, pk in zip(posts, pks):
+            post.pk = pk
+    for (index, data), post in zip(valid, posts):
+        results[index] = {'index': index, 'status': 'created', 'id': post.pk}
+
+    timeline.fan_out_posts(posts)
+    counters.change_author_stats(user.pk, posts_count=len(posts))
+    _after_write(user, posts)
+
+
+def _update(user, items, indexes, results):
+    valid = _validated(items, indexes, results, partial=True)
+    if not valid:
+        return
+    posts = Post.objects.filter(author=user).in_bulk(
+        [_as_int(items[index]['id']) for index, data in valid])
+    changed, fields = [], set()
+    for index, data in valid:
+        post = posts.get(_as_int(items[index]['id']))
+        if post is None:
+            results[index] = _error(index, {'id': ['Post not found.']})
+            continue
+        for field, value in data.items():
+            setattr(post, field, value)
+        fields.update(data)
+        changed.append(post)
+        results[index] = {'index': index, 'status': 'updated', 'id': post.pk}
+    if changed and fields:
+        Post.objects.bulk_update(changed, fields, batch_size=BATCH_SIZE)
+    _after_write(user, changed)
+
+
+def _after_write(user, posts):
+    if not posts:
+        return
+    if search.available():
+        for start in range(0, len(posts), BATCH_SIZE):
+            search.index_posts(
+                [post.pk for post in posts[start:start + BATCH_SIZE]])
+    scopes = {caching.POSTS, caching.author_scope(user.pk)}
+    scopes.update(caching.group_scope(post.group_id)
+                  for post in posts if post.group_id is not None)
+    caching.bump_on_commit(*scopes)
+
+
+def delete(user, ids):
+    """Удаляет посты пользователя. Удаление идёт обычным `delete()`
+    по queryset, так что сигналы и каскады срабатывают как всегда."""
+    pks = {_as_int(pk) for pk in ids}
+    with transaction.atomic():
+        posts = Post.objects.filter(author=user, pk__in=pks - {None})
+        found = set(posts.values_list('pk', flat=True))
+        posts.delete()
+    return [
+        {'index': index, 'status': 'deleted', 'id': _as_int(pk)}
+        if _as_int(pk) in found else _error(index, {'id': ['Post not found.']})
+        for index, pk in enumerate(ids)]
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,152 @@
+"""Версионированный кэш фрагментов лент.
+
+Каждая область (вся лента, группа, автор) имеет счётчик поколения в
+кэше. Ключ фрагмента включает поколения всех областей, от которых
+зависит страница, поэтому изменение поста или комментария делает старые
+фрагменты недостижимыми, а не ждёт истечения таймаута.
+
+Поколение — время последнего изменения области в наносекундах, поэтому
+после вытеснения из кэша значения не повторяются, а из поколений
+получаются и валидаторы условных GET-запросов (`conditional`).
+
+Поколение сдвигается сразу после записи в основную базу, а реплика
+отстаёт. Поэтому страницу, чьё поколение моложе `REPLICA_PIN_SECONDS`,
+запрос читает с основной базы: иначе старое содержимое с реплики
+закэшировалось бы под новым ключом и ETag.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from yatube import routers
+
+KEY_PREFIX = 'feedgen'
+# Группы выводятся во всех лентах, поэтому их изменения сбрасывают всё
+GLOBAL = 'global'
+POSTS = 'posts'
+
+
+def group_scope(group_id):
+    return 'group:%s' % group_id
+
+
+def author_scope(author_id):
+    return 'author:%s' % author_id
+
+
+def post_scopes(post, previous_group_id=None):
+    scopes = {POSTS, author_scope(post.author_id)}
+    for group_id in (post.group_id, previous_group_id):
+        if group_id is not None:
+            scopes.add(group_scope(group_id))
+    return scopes
+
+
+def _key(scope):
+    return '%s:%s' % (KEY_PREFIX, scope)
+
+
+def get_versions(*scopes):
+    keys = [_key(scope) for scope in (GLOBAL,) + scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # область давно не менялась (иначе ключ был бы в кэше):
+            # новое поколение не должно считаться свежим записанным
+            now = time.time_ns() - _replica_lag()
+            cache.add(key, now, None)
+            versions[key] = cache.get(key, now)
+    return [versions[key] for key in keys]
+
+
+def _replica_lag():
+    return settings.REPLICA_PIN_SECONDS * 10 ** 9
+
+
+def page_versions(*scopes):
+    """`get_versions` для ключа страницы или ETag: если какая-то область
+    менялась недавно, дальше запрос читает с основной базы."""
+    versions = get_versions(*scopes)
+    if time.time_ns() - max(versions) < _replica_lag():
+        routers.pin_primary()
+    return versions
+
+
+def bump(*scopes):
+    keys = [_key(scope) for scope in scopes]
+    current = cache.get_many(keys)
+    now = time.time_ns()
+    # +1 на случай грубых часов: поколение обязано измениться
+    cache.set_many(
+        {key: max(now, current.get(key, 0) + 1) for key in keys}, None)
+
+
+def bump_on_commit(*scopes):
+    """`bump` сразу и ещё раз после коммита: иначе параллельный запрос,
+    увидевший новое поколение раньше новых строк, закэширует под ним
+    старую страницу."""
+    bump(*scopes)
+    transaction.on_commit(lambda: bump(*scopes))
+
+
+def fragment_key(request, *scopes):
+    """Строка для `{% cache %}`: области с их поколениями и пользователь.
+
+    Имена областей обязательны: `bump` пишет одно значение во все
+    области сразу, и без имён лента одной группы досталась бы другой.
+    Пользователь нужен потому, что в карточке поста автору показывается
+    ссылка на редактирование.
+    """
+    user_id = request.user.pk if request.user.is_authenticated else 0
+    versions = page_versions(*scopes)
+    parts = ['%s=%s' % pair for pair in zip((GLOBAL,) + scopes, versions)]
+    return '.'.join(parts + ['user=%s' % user_id])
+
+
+def conditional(scopes):
+    """Декоратор представления: ETag и Last-Modified из поколений
+    областей, которые вернёт `scopes(request, *args, **kwargs)`.
+
+    Если валидаторы клиента совпали, отвечает 304 без запросов к
+    базе за содержимым и без рендеринга. `scopes` может вернуть None,
+    тогда запрос обрабатывается как обычно (например, чтобы отдать 404).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            page_scopes = scopes(request, *args, **kwargs)
+            if page_scopes is None:
+                return view(request, *args, **kwargs)
+            versions = page_versions(*page_scopes)
+            etag = quote_etag(_etag(request, versions))
+            last_modified = max(versions) // 10 ** 9
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code < 300 and not response.streaming:
+                    response.setdefault('ETag', etag)
+                    response.setdefault(
+                        'Last-Modified', http_date(last_modified))
+            return response
+        return wrapper
+    return decorator
+
+
+def _etag(request, versions):
+    """Кроме поколений ответ зависит от пользователя, адреса с
+    параметрами, формата и CSRF-токена в формах страницы."""
+    user_id = request.user.pk if request.user.is_authenticated else 0
+    parts = versions + [
+        user_id, request.get_full_path(), request.META.get('HTTP_ACCEPT', ''),
+        request.META.get('CSRF_COOKIE', '')]
+    return hashlib.md5(
+        '|'.join(str(part) for part in parts).encode()).hexdigest()
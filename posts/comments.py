@@ -0,0 +1,63 @@
+"""Комментарии поста: постраничный вывод веток.
+
+Страница — корневые комментарии с keyset-пагинацией по
+(`created`, `id`) и авторами в том же запросе. Ответы на всю страницу
+выбираются вторым запросом — диапазоном `path` поста от первой до
+последней ветки страницы, по индексу (`post`, `path`) и уже в порядке
+веток.
+"""
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, LPad
+
+from .models import Comment
+from .pagination import CursorPaginator
+
+
+class CommentPaginator(CursorPaginator):
+    def __init__(self, post_id, per_page):
+        super().__init__(
+            Comment.objects.filter(post_id=post_id, parent=None)
+            .select_related('author'),
+            per_page, ordering=('created', 'pk'))
+
+    def prepare_rows(self, rows):
+        """Кладёт в `thread_replies` каждого корня его ответы."""
+        for comment in rows:
+            comment.thread_replies = []
+        if not rows:
+            return rows
+        roots = {comment.pk: comment for comment in rows}
+        low = Comment.thread_bounds(min(roots))[0]
+        high = Comment.thread_bounds(max(roots))[1]
+        # в диапазон могут попасть ветки с других страниц, если
+        # порядок по времени разошёлся с порядком id — их отбрасываем
+        replies = Comment.objects.filter(
+            post_id=rows[0].post_id, path__gt=low, path__lt=high,
+            parent__isnull=False,
+        ).select_related('author').order_by('path')
+        for reply in replies:
+            if reply.parent_id in roots:
+                roots[reply.parent_id].thread_replies.append(reply)
+        return rows
+
+
+def reply_parent(post, value):
+    """id корня ветки для ответа на комментарий `value` этого поста.
+    Ответ на ответ уходит в ту же ветку."""
+    try:
+        pk = int(value)
+    except (TypeError, ValueError):
+        return None
+    parent = Comment.objects.filter(pk=pk, post=post).values_list(
+        'pk', 'parent_id').first()
+    if parent is None:
+        return None
+    return parent[1] or parent[0]
+
+
+def fill_paths(queryset=None):
+    """Пути для комментариев, созданных через `bulk_create` (он не
+    вызывает `save`). Такие комментарии считаются корневыми."""
+    queryset = Comment.objects.all() if queryset is None else queryset
+    return queryset.filter(path='', parent=None).update(path=LPad(
+        Cast('pk', CharField()), Comment.PATH_WIDTH, Value('0')))
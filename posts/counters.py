@@ -0,0 +1,54 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import AuthorStats, Comment, Follow, Post, User
+
+
+def shifted(name, delta):
+    # счётчик мог разойтись с данными (bulk_create, сырой SQL до
+    # recount_stats): ниже нуля не уходим, иначе упадёт CHECK поля
+    if delta < 0:
+        return Greatest(F(name) + delta, Value(0))
+    return F(name) + delta
+
+
+def change_author_stats(user_id, **deltas):
+    """Атомарно сдвигает счётчики автора: `posts_count=1` и т.п."""
+    updates = {name: shifted(name, delta) for name, delta in deltas.items()}
+    updated = AuthorStats.objects.filter(user_id=user_id).update(**updates)
+    # строки может не быть у пользователей, созданных в обход сигналов;
+    # при уменьшении её не создаём — пользователь может удаляться
+    if not updated and all(delta > 0 for delta in deltas.values()):
+        AuthorStats.objects.get_or_create(user_id=user_id)
+        AuthorStats.objects.filter(user_id=user_id).update(**updates)
+
+
+def change_comments_count(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=shifted('comments_count', delta))
+
+
+def _count(queryset, field):
+    return Coalesce(Subquery(
+        queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(count=Count('pk')).values('count')), Value(0))
+
+
+def recount(user_ids=None):
+    """Пересчитывает все счётчики по исходным таблицам."""
+    users = User.objects.all()
+    posts = Post.objects.all()
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+        posts = posts.filter(author_id__in=user_ids)
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(user_id=pk) for pk in users.exclude(
+            stats__isnull=False).values_list('pk', flat=True)],
+        ignore_conflicts=True)
+    stats = AuthorStats.objects.filter(user__in=users)
+    stats.update(
+        posts_count=_count(Post.objects.all(), 'author'),
+        followers_count=_count(Follow.objects.all(), 'author'),
+        following_count=_count(Follow.objects.all(), 'user'),
+    )
+    posts.update(comments_count=_count(Comment.objects.all(), 'post'))
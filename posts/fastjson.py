@@ -0,0 +1,128 @@
+"""Быстрый путь JSON для чтения постов через API.
+
+Строки берутся `values()` одним запросом (плюс запрос за копиями
+картинок), словари для ответа собираются напрямую, без полей
+сериализатора, и кодируются `orjson`, если он установлен. Результат
+побайтно совпадает с `PostSerializer` + `JSONRenderer` в настройках
+по умолчанию (компактный UTF-8).
+"""
+import json
+
+from django.http import HttpResponse
+from rest_framework import serializers
+
+from .models import Post, PostImageVariant
+from .serializers import PostSerializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# колонки values() под каждое выводимое поле
+VALUES = {
+    'text': ('text',),
+    'author': ('author',),
+    'image': ('image',),
+    'group': ('group',),
+    'comments_count': ('comments_count',),
+}
+EXPANDED_VALUES = {
+    'author': ('author__username', 'author__first_name', 'author__last_name'),
+    'group': ('group__title', 'group__slug'),
+}
+
+
+def dumps(data):
+    if orjson is not None:
+        content = orjson.dumps(data)
+    else:
+        content = json.dumps(
+            data, ensure_ascii=False, separators=(',', ':'),
+            allow_nan=False).encode()
+    # как JSONRenderer: JSON должен оставаться подмножеством JavaScript
+    return content.replace(
+        b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def json_response(data, status=200):
+    response = HttpResponse(
+        dumps(data), status=status, content_type='application/json')
+    # как у Response из DRF: данные до кодирования доступны в .data
+    response.data = data
+    return response
+
+
+def accepts(request):
+    """Быстрый путь — только для обычного компактного JSON."""
+    renderer = getattr(request, 'accepted_renderer', None)
+    return (renderer is not None and renderer.format == 'json'
+            and 'indent' not in (request.accepted_media_type or ''))
+
+
+def output_fields(fields=None, expand=None):
+    """Поля ответа в том же порядке, что и у `PostSerializer`."""
+    expand = set(expand or ())
+    names = list(PostSerializer.Meta.fields) + [
+        name for name in ('group', 'comments_count') if name in expand]
+    if fields:
+        names = [name for name in names if name in fields or name in expand]
+    return names
+
+
+def values(queryset, fields=None, expand=None):
+    """queryset словарей с ключами `pk`, `pub_date` и колонками полей."""
+    columns = ['pk', 'pub_date']
+    for name in output_fields(fields, expand):
+        columns.extend(VALUES.get(name, ()))
+        if name in (expand or ()):
+            columns.extend(EXPANDED_VALUES.get(name, ()))
+    return queryset.select_related(None).prefetch_related(None).values(
+        *columns)
+
+
+def items(rows, fields=None, expand=None):
+    expand = set(expand or ())
+    names = output_fields(fields, expand)
+    image_url = Post._meta.get_field('image').storage.url
+    pub_date = serializers.DateTimeField().to_representation
+    variants = {}
+    if 'image_variants' in names and rows:
+        variant_url = PostImageVariant._meta.get_field('file').storage.url
+        for post_id, width, height, format, name in (
+                PostImageVariant.objects.filter(
+                    post_id__in=[row['pk'] for row in rows]).values_list(
+                        'post_id', 'width', 'height', 'format', 'file')):
+            variants.setdefault(post_id, []).append({
+                'width': width, 'height': height, 'format': format,
+                'url': variant_url(name) if name else None})
+
+    result = []
+    for row in rows:
+        item = {}
+        for name in names:
+            if name == 'id':
+                item['id'] = row['pk']
+            elif name == 'pub_date':
+                item['pub_date'] = pub_date(row['pub_date'])
+            elif name == 'image':
+                item['image'] = image_url(row['image']) if row['image'] else None
+            elif name == 'image_variants':
+                item['image_variants'] = variants.get(row['pk'], [])
+            elif name == 'author' and 'author' in expand:
+                item['author'] = {
+                    'id': row['author'],
+                    'username': row['author__username'],
+                    'first_name': row['author__first_name'],
+                    'last_name': row['author__last_name'],
+                }
+            elif name == 'group':
+                item['group'] = None if row['group'] is None else {
+                    'id': row['group'],
+                    'title': row['group__title'],
+                    'slug': row['group__slug'],
+                }
+            else:
+                item[name] = row[name]
+        result.append(item)
+    return result
@@ -1,8 +1,37 @@
 from django.forms import ModelForm, Textarea
+from django.forms.models import ModelChoiceIterator
 from .models import Post, Comment
+from . import groups
 from django import forms
 
 
+class GroupChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for group in groups.all_groups():
+            yield self.choice(group)
+
+    def __len__(self):
+        return len(groups.all_groups()) + (
+            self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(
+            groups.all_groups())
+
+
+def group_to_python(value):
+    if value in forms.Field.empty_values:
+        return None
+    group = groups.get(value)
+    if group is None:
+        raise forms.ValidationError(
+            forms.ModelChoiceField.default_error_messages['invalid_choice'],
+            code='invalid_choice')
+    return group
+
+
 class PostForm(ModelForm):
     class Meta:
         model = Post
@@ -17,6 +46,15 @@ class PostForm(ModelForm):
             "group": "Выберете группу к которой относится пост"
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # поле остаётся ModelChoiceField, но список групп и проверка
+        # выбранной берутся из справочника posts/groups.py, без запросов
+        field = self.fields['group']
+        field.iterator = GroupChoiceIterator
+        field.widget.choices = field.choices
+        field.to_python = group_to_python
+
 
 class CommentForm(ModelForm):
     class Meta:
@@ -0,0 +1,89 @@
+"""Справочник групп.
+
+Групп мало, меняются они редко, а нужны почти на каждой странице:
+поиск группы по slug, выбор группы в форме поста, ссылки `#группа` в
+карточках. Поэтому все группы держатся в памяти процесса, а общий кэш
+хранит их список для остальных процессов.
+
+Версия справочника — поколение `caching.GLOBAL`, которое сигнал
+`group_changed` сдвигает при каждом сохранении и удалении группы.
+Версия сверяется с общим кэшем не чаще раза за HTTP-запрос; вне
+запросов — при каждом обращении.
+"""
+import threading
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS
+from django.dispatch import receiver
+
+from . import caching
+from .models import Group
+
+CACHE_KEY = 'groups:directory'
+
+Directory = namedtuple('Directory', 'version groups by_id by_slug')
+
+_directory = None
+_local = threading.local()
+
+
+def directory():
+    global _directory
+    current = _directory
+    if current is not None and getattr(_local, 'checked', None) is current:
+        return current
+    version = caching.get_versions()[0]
+    if current is None or current.version != version:
+        current = _directory = _load(version)
+    if getattr(_local, 'in_request', False):
+        _local.checked = current
+    return current
+
+
+def _load(version):
+    cached = cache.get(CACHE_KEY)
+    if cached is not None and cached[0] == version:
+        groups = cached[1]
+    else:
+        # реплика могла ещё не получить изменение, из-за которого
+        # сдвинулась версия; порядок по slug идёт по его индексу
+        groups = list(Group.objects.using(DEFAULT_DB_ALIAS).order_by('slug'))
+        cache.set(CACHE_KEY, (version, groups), None)
+    return Directory(
+        version, groups,
+        {group.pk: group for group in groups},
+        {group.slug: group for group in groups})
+
+
+def clear():
+    global _directory
+    _directory = None
+
+
+def all_groups():
+    return directory().groups
+
+
+def get(pk):
+    try:
+        return directory().by_id.get(int(pk))
+    except (TypeError, ValueError):
+        return None
+
+
+def by_slug(slug):
+    return directory().by_slug.get(slug)
+
+
+@receiver(request_started)
+def request_started_handler(sender, **kwargs):
+    _local.in_request = True
+    _local.checked = None
+
+
+@receiver(request_finished)
+def request_finished_handler(sender, **kwargs):
+    _local.in_request = False
+    _local.checked = None
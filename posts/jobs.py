@@ -0,0 +1,185 @@
+"""Очередь фоновых задач в базе данных.
+
+`enqueue` записывает задачу строкой `Job` в той же транзакции, что и
+изменения, которые её породили: откатилась транзакция — нет и задачи.
+Воркер (`manage.py run_worker`) захватывает готовые задачи арендой на
+`JOB_LEASE_SECONDS`: там, где база умеет, через
+`SELECT ... FOR UPDATE SKIP LOCKED`, и всегда условным UPDATE, так что
+одну задачу не выполнят двое и в SQLite. Упавшая задача повторяется с
+экспоненциальной задержкой, после `max_attempts` попыток остаётся со
+статусом `failed` и текстом ошибки — её видно и можно перезапустить в
+админке.
+
+Задачи — функции, зарегистрированные декоратором `task`, аргументы
+должны сериализоваться в JSON. Задача может выполниться повторно
+(например, если воркер упал после работы, но до отметки), поэтому
+должна быть идемпотентной.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# имя -> функция
+TASKS = {}
+# сколько символов трассировки хранить в last_error
+MAX_ERROR_LENGTH = 5000
+
+
+def task(name):
+    def decorator(func):
+        TASKS[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, *args, delay=0, max_attempts=None, **kwargs):
+    if name not in TASKS:
+        raise ValueError('Неизвестная задача: %s' % name)
+    return Job.objects.create(
+        name=name, payload=json.dumps({'args': args, 'kwargs': kwargs}),
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS)
+
+
+def worker_name(suffix=''):
+    name = '%s:%d' % (socket.gethostname(), os.getpid())
+    return '%s:%s' % (name, suffix) if suffix else name
+
+
+def backoff(attempts):
+    """Задержка перед попыткой номер `attempts + 1`."""
+    return min(settings.JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1),
+               settings.JOB_RETRY_MAX_SECONDS)
+
+
+def claim(worker, limit=1):
+    """Захватывает до `limit` готовых задач и возвращает их."""
+    now = timezone.now()
+    ready = Job.objects.filter(
+        Q(status=Job.QUEUED, run_at__lte=now)
+        | Q(status=Job.RUNNING, locked_until__lt=now)
+    ).order_by('run_at', 'pk')
+    claimed = []
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if connection.features.has_select_for_update_skip_locked:
+            ready = ready.select_for_update(skip_locked=True)
+        for job in ready.using(DEFAULT_DB_ALIAS)[:limit]:
+            lease = dict(status=Job.RUNNING, locked_by=worker,
+                         locked_until=now + timedelta(
+                             seconds=settings.JOB_LEASE_SECONDS))
+            # без блокировки строк (SQLite) задачу мог уже забрать
+            # другой воркер: захват удался, только если она не менялась
+            updated = Job.objects.filter(
+                pk=job.pk, status=job.status, attempts=job.attempts,
+            ).update(attempts=F('attempts') + 1, **lease)
+            if updated:
+                for field, value in lease.items():
+                    setattr(job, field, value)
+                job.attempts += 1
+                claimed.append(job)
+    return claimed
+
+
+def _finish(job, **fields):
+    # аренду могли отдать другому воркеру — тогда отметку делает он
+    return Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        locked_until=None, **fields)
+
+
+def execute(job):
+    """Выполняет захваченную задачу и отмечает результат."""
+    func = TASKS.get(job.name)
+    try:
+        if func is None:
+            raise LookupError('Неизвестная задача: %s' % job.name)
+        if job.attempts > job.max_attempts:
+            raise RuntimeError('Аренда истекла на последней попытке')
+        payload = json.loads(job.payload)
+        func(*payload.get('args', ()), **payload.get('kwargs', {}))
+    except Exception:
+        error = traceback.format_exc()[-MAX_ERROR_LENGTH:]
+        if job.attempts >= job.max_attempts:
+            logger.error('Задача %s не выполнена: %s', job, error)
+            _finish(job, status=Job.FAILED, last_error=error,
+                    finished=timezone.now())
+        else:
+            logger.warning('Задача %s упала, повтор: %s', job, error)
+            _finish(job, status=Job.QUEUED, last_error=error,
+                    run_at=timezone.now() + timedelta(
+                        seconds=backoff(job.attempts)))
+        return False
+    _finish(job, status=Job.DONE, finished=timezone.now())
+    return True
+
+
+def run_next(worker):
+    """Выполняет одну готовую задачу. False — очередь пуста."""
+    jobs = claim(worker)
+    for job in jobs:
+        execute(job)
+    return bool(jobs)
+
+
+def retry(queryset):
+    """Возвращает задачи в очередь с новым запасом попыток."""
+    return queryset.exclude(status=Job.RUNNING).update(
+        status=Job.QUEUED, attempts=0, run_at=timezone.now(),
+        locked_until=None, locked_by='', finished=None)
+
+
+class Worker:
+    """Пул потоков, каждый берёт задачи по одной. С одним потоком
+    работает в вызывающем потоке. `burst` — выйти, когда очередь
+    опустела."""
+
+    def __init__(self, threads=1, poll=None, burst=False, name=None):
+        self.threads = max(threads, 1)
+        self.poll = settings.JOB_POLL_SECONDS if poll is None else poll
+        self.burst = burst
+        self.name = name or worker_name()
+        self.stopping = threading.Event()
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        if self.threads == 1:
+            return self.loop(self.name)
+        pool = [threading.Thread(
+            target=self.loop, args=('%s:%d' % (self.name, index),),
+            name='jobs-%d' % index) for index in range(self.threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+
+    def loop(self, name):
+        try:
+            while not self.stopping.is_set():
+                try:
+                    found = run_next(name)
+                except Exception:
+                    # база недоступна и т.п.: подождать и попробовать снова
+                    logger.exception('Ошибка воркера %s', name)
+                    found = False
+                if not found:
+                    if self.burst:
+                        return
+                    self.stopping.wait(self.poll)
+        finally:
+            # у каждого потока своё соединение с базой
+            connections.close_all()
@@ -0,0 +1,153 @@
+"""Живая лента новых постов.
+
+Сигнал `post_save` после коммита публикует событие в `broker` — pub/sub
+в памяти процесса с кольцевым буфером последних событий. Клиенты
+читают его через SSE (`/api/v1/posts/stream/`) или long-poll
+(`?poll=1`) и по `Last-Event-ID` догоняют пропущенное после
+переподключения. Фрагмент HTML рендерится один раз при публикации.
+
+Брокер живёт в одном процессе: при нескольких процессах клиент видит
+посты, созданные только в своём.
+
+Каждый поток и long-poll занимает рабочий поток сервера, поэтому их
+одновременно не больше `LIVE_MAX_STREAMS` на процесс. Сверх лимита
+SSE получает 503 с `Retry-After`, а long-poll отвечает сразу, не
+дожидаясь событий, — клиент переходит на короткие опросы.
+"""
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.template.loader import render_to_string
+
+# сколько последних событий хранится для догоняющих клиентов
+BUFFER_SIZE = 200
+
+
+class Broker:
+    def __init__(self, size=BUFFER_SIZE):
+        self.condition = threading.Condition()
+        self.events = deque(maxlen=size)
+        self.ids = itertools.count(1)
+        self.last_id = 0
+
+    def publish(self, data):
+        with self.condition:
+            self.last_id = next(self.ids)
+            self.events.append((self.last_id, data))
+            self.condition.notify_all()
+        return self.last_id
+
+    def since(self, last_id):
+        with self.condition:
+            return [event for event in self.events if event[0] > last_id]
+
+    def wait(self, last_id, timeout):
+        """События после `last_id`; если их нет — ждёт новых
+        не дольше `timeout` секунд."""
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.last_id > last_id, timeout)
+        return self.since(last_id)
+
+
+broker = Broker()
+
+_streams = 0
+_streams_lock = threading.Lock()
+
+
+def acquire_stream():
+    """Занимает слот потока; False — свободных нет."""
+    global _streams
+    with _streams_lock:
+        if _streams >= settings.LIVE_MAX_STREAMS:
+            return False
+        _streams += 1
+        return True
+
+
+def release_stream():
+    global _streams
+    with _streams_lock:
+        _streams -= 1
+
+
+class Stream:
+    """Итератор ответа SSE. Слот освобождается при закрытии ответа,
+    даже если сервер так и не начал читать генератор."""
+
+    def __init__(self, events):
+        self.events = events
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.events)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.events.close()
+            release_stream()
+
+
+def publish_post(post):
+    return broker.publish({
+        'post': post.pk,
+        'author': post.author_id,
+        'group': post.group_id,
+        'html': render_to_string('includes/post_content.html', {
+            'post': post, 'show_add_comments': True}),
+    })
+
+
+def last_event_id(request):
+    value = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get(
+        'last_id')
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        # новый клиент получает только то, что появится после подключения
+        return broker.last_id
+    # id из прошлого запуска процесса: счётчик начался заново
+    return value if value <= broker.last_id else broker.last_id
+
+
+def event_filter(request):
+    """`?follow=1` оставляет только посты авторов из подписок."""
+    if not request.GET.get('follow') or not request.user.is_authenticated:
+        return lambda data: True
+    authors = set(request.user.follower.values_list('author_id', flat=True))
+    return lambda data: data['author'] in authors
+
+
+def format_event(event_id, data):
+    return 'id: %d\nevent: post\ndata: %s\n\n' % (
+        event_id, json.dumps(data, ensure_ascii=False))
+
+
+def sse_events(last_id, accept):
+    """Генератор SSE: события, пинги раз в `LIVE_HEARTBEAT` секунд.
+    Через `LIVE_STREAM_SECONDS` поток закрывается, чтобы не держать
+    рабочий поток вечно, и EventSource переподключается сам."""
+    heartbeat = settings.LIVE_HEARTBEAT
+    deadline = time.monotonic() + settings.LIVE_STREAM_SECONDS
+    yield 'retry: %d\n\n' % settings.LIVE_RETRY_MS
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        events = broker.wait(last_id, min(heartbeat, remaining))
+        if not events:
+            yield ': ping\n\n'
+            continue
+        for event_id, data in events:
+            last_id = event_id
+            if accept(data):
+                yield format_event(event_id, data)
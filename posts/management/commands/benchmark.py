@@ -0,0 +1,100 @@
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment)
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный бенчмарк: синтетические данные во временной базе, '
+            'смесь запросов к лентам и API, перцентили задержки и RSS')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--groups', type=int, default=5)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--follows', type=int, default=300)
+        parser.add_argument('--comments', type=int, default=2000)
+        parser.add_argument(
+            '--requests', type=int, default=500,
+            help='число запросов в сгенерированной смеси')
+        parser.add_argument(
+            '--mix', type=json.loads, default=None,
+            help='веса сценариев в JSON, например {"index": 3, "profile": 1}')
+        parser.add_argument('--warmup', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--record', help='сохранить смесь запросов в JSONL')
+        parser.add_argument(
+            '--replay', help='проиграть смесь запросов из JSONL')
+        parser.add_argument(
+            '--serialization', action='store_true',
+            help='сравнить PostSerializer с быстрым путём JSON')
+        parser.add_argument('--output', help='сохранить отчёт в JSON')
+        parser.add_argument(
+            '--compare', help='отчёт прошлого прогона для сравнения p95')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # отдельная база и DEBUG=False, как в тестах: connection.queries
+        # не копится, рабочие данные не трогаются
+        setup_test_environment(debug=False)
+        old_config = setup_databases(verbosity=0, interactive=False)
+        # лимиты частоты отвечали бы 429 на смесь от нескольких
+        # пользователей, и отказы попали бы в задержки и ошибки
+        no_limits = override_settings(RATE_LIMITS={})
+        no_limits.enable()
+        try:
+            dataset = benchmark.seed(
+                options['users'], options['groups'], options['posts'],
+                options['follows'], options['comments'], rng)
+            if options['replay']:
+                requests = benchmark.load_jsonl(options['replay'])
+            else:
+                requests = benchmark.build_mix(
+                    options['requests'], options['mix'], rng)
+            if options['record']:
+                benchmark.save_jsonl(requests, options['record'])
+            samples = benchmark.replay(requests, options['warmup'])
+            result = benchmark.report(samples, dataset)
+            if options['serialization']:
+                result['serialization'] = benchmark.serialization()
+        except ValueError as error:
+            raise CommandError(error)
+        finally:
+            no_limits.disable()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        self.print_report(result)
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                json.dump(result, out, indent=2, ensure_ascii=False)
+        if options['compare']:
+            with open(options['compare']) as source:
+                old = json.load(source)
+            for name, before, after, ratio in benchmark.compare(old, result):
+                self.stdout.write('%-16s p95 %8.2f -> %8.2f ms (x%.2f)' % (
+                    name, before, after, ratio))
+
+    def print_report(self, result):
+        self.stdout.write('%-16s %6s %6s %9s %9s %9s %8s' % (
+            'view', 'reqs', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+        rows = list(result['views'].items()) + [('total', result['total'])]
+        for name, stats in rows:
+            self.stdout.write('%-16s %6d %6d %9.2f %9.2f %9.2f %8.1f' % (
+                name, stats['requests'], stats['errors'], stats['p50_ms'],
+                stats['p95_ms'], stats['p99_ms'], stats['queries_mean']))
+        if 'serialization' in result:
+            stats = result['serialization']
+            self.stdout.write(
+                'JSON, %d постов: serializer %.2f ms, fastjson (%s) %.2f ms, '
+                'x%.1f' % (stats['page_size'], stats['serializer_ms'],
+                           stats['encoder'], stats['fastjson_ms'],
+                           stats['speedup']))
+        self.stdout.write(self.style.SUCCESS(
+            'Пиковый RSS: %d КБ' % result['max_rss_kb']))
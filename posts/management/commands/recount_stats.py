@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики авторов (AuthorStats) и комментариев постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='user_ids',
+            help='id пользователя; можно указать несколько раз')
+
+    def handle(self, *args, **options):
+        counters.recount(options['user_ids'])
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны'))
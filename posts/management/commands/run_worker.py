@@ -0,0 +1,65 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import jobs
+
+
+def run_process(index, threads, poll, burst):
+    worker = jobs.Worker(threads, poll, burst, jobs.worker_name(str(index)))
+    signal.signal(signal.SIGTERM, lambda *args: worker.stop())
+    worker.run()
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди в базе (posts/jobs.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=1,
+            help='число потоков в каждом процессе')
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='число процессов; больше одного — дочерние процессы')
+        parser.add_argument(
+            '--poll', type=float, default=None,
+            help='пауза в секундах, когда очередь пуста')
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='выйти, когда очередь опустеет')
+
+    def handle(self, *args, **options):
+        threads, poll, burst = (
+            options['threads'], options['poll'], options['burst'])
+        processes = max(options['processes'], 1)
+        if processes == 1:
+            worker = jobs.Worker(threads, poll, burst)
+            # SIGTERM: доделать текущие задачи и выйти
+            signal.signal(signal.SIGTERM, lambda *args: worker.stop())
+            try:
+                worker.run()
+            except KeyboardInterrupt:
+                worker.stop()
+            return
+        # открытые соединения не должны достаться дочерним процессам
+        connections.close_all()
+        children = [multiprocessing.Process(
+            target=run_process, args=(index, threads, poll, burst))
+            for index in range(processes)]
+        for child in children:
+            child.start()
+
+        def stop(*args):
+            for child in children:
+                child.terminate()
+
+        signal.signal(signal.SIGTERM, stop)
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            stop()
+            for child in children:
+                child.join()
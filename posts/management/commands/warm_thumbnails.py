@@ -0,0 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Заранее готовит превью и копии картинок существующих постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=2,
+            help='число потоков для генерации превью')
+
+    def handle(self, *args, **options):
+        posts = list(Post.objects.exclude(image='').exclude(
+            image__isnull=True).values_list('pk', 'image'))
+        with ThreadPoolExecutor(max(options['workers'], 1)) as executor:
+            list(executor.map(lambda row: thumbnails.run_in_worker(*row),
+                              posts))
+        self.stdout.write(self.style.SUCCESS(
+            'Обработано картинок: %d' % len(posts)))
@@ -13,10 +13,31 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    def feed(self):
+        """Посты для лент: автор одним JOIN, группа — из справочника
+        posts/groups.py (тег `post_group`), число комментариев берётся
+        из счётчика `comments_count`, чтобы шаблон не ходил в базу на
+        каждый пост."""
+        return self.select_related('author').prefetch_related(
+            'image_variants')
+
+
 class Post(models.Model):
 
     class Meta:
         ordering = ['-pub_date']
+        # по индексу на каждую ленту: фильтр + порядок keyset-пагинации
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='posts_post_feed_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='posts_post_group_feed_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='posts_post_author_feed_idx'),
+        ]
+
+    objects = PostQuerySet.as_manager()
 
     text = models.TextField()
     pub_date = models.DateTimeField("date published", auto_now_add=True)
@@ -26,15 +47,74 @@ class Post(models.Model):
         Group, on_delete=models.SET_NULL, blank=True, null=True,
         related_name="posts")
     image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # счётчики меняет только posts/counters.py через F(); обычное
+    # сохранение записало бы поверх прочитанное ранее значение
+    COUNTER_FIELDS = ('comments_count',)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.COUNTER_FIELDS]
+        super().save(*args, **kwargs)
 
 
 class Comment(models.Model):
+    """Комментарий или ответ на него. Ответы — один уровень: `parent`
+    всегда корневой комментарий. `path` — id корня, дополненный нулями,
+    у ответа ещё точка и свой id, так что ветка — диапазон путей и
+    читается одним запросом по индексу уже в нужном порядке."""
+
+    PATH_WIDTH = 10
+
+    class Meta:
+        ordering = ['created']
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='posts_comment_post_idx'),
+            # keyset-пагинация корневых комментариев поста
+            models.Index(fields=['post', 'parent', 'created', 'id'],
+                         name='posts_comment_roots_idx'),
+            # ответы страницы: диапазон путей внутри поста
+            models.Index(fields=['post', 'path'],
+                         name='posts_comment_thread_idx'),
+        ]
+
     post = models.ForeignKey(
         Post, on_delete=models.CASCADE, related_name="comments")
     author = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="comments")
+    parent = models.ForeignKey(
+        'self', on_delete=models.CASCADE, blank=True, null=True,
+        related_name="replies")
     text = models.TextField()
     created = models.DateTimeField("Created", auto_now_add=True)
+    path = models.CharField(max_length=21, blank=True, editable=False)
+
+    @classmethod
+    def make_path(cls, pk, parent_id=None):
+        path = '%0*d' % (cls.PATH_WIDTH, pk)
+        if parent_id is not None:
+            path = '%0*d.%s' % (cls.PATH_WIDTH, parent_id, path)
+        return path
+
+    @classmethod
+    def thread_bounds(cls, root_id):
+        """Диапазон путей ветки: корень и все ответы на него."""
+        prefix = cls.make_path(root_id)
+        # '/' идёт в ASCII сразу за '.'
+        return prefix, prefix + '/'
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if not self.path:
+            # путь содержит id, поэтому известен только после вставки
+            self.path = self.make_path(self.pk, self.parent_id)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
 
 
 class Follow(models.Model):
@@ -45,3 +125,86 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ("user", "author",)
+
+
+class PostImageVariant(models.Model):
+    """Готовая копия картинки поста определённой ширины и формата
+    для `srcset`. Строится в фоне, см. posts/thumbnails.py."""
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name="image_variants")
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    format = models.CharField(max_length=10)
+    file = models.FileField(max_length=255)
+
+    class Meta:
+        unique_together = ("post", "width", "format",)
+
+
+class AuthorStats(models.Model):
+    """Денормализованные счётчики автора. Меняются атомарно через F()
+    в сигналах, пересчитываются командой `recount_stats`."""
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True,
+        related_name="stats")
+    posts_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
+
+class TimelineEntry(models.Model):
+    """Материализованная лента подписок: строка на каждую пару
+    (подписчик, пост автора). Дата копируется из поста, чтобы лента
+    читалась диапазоном по индексу (user, pub_date, post)."""
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="timeline")
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name="timeline_entries")
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("user", "post",)
+        indexes = [
+            models.Index(fields=["user", "-pub_date", "-post"],
+                         name="posts_timeline_feed_idx"),
+        ]
+
+
+class Job(models.Model):
+    """Фоновая задача очереди posts/jobs.py. Воркер захватывает задачу
+    на время аренды (`locked_until`); если он упал, по истечении аренды
+    задачу заберёт другой."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'в очереди'),
+        (RUNNING, 'выполняется'),
+        (DONE, 'выполнена'),
+        (FAILED, 'не выполнена'),
+    )
+
+    name = models.CharField(max_length=100)
+    # аргументы задачи в JSON: {"args": [...], "kwargs": {...}}
+    payload = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField()
+    locked_until = models.DateTimeField(blank=True, null=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created']
+        indexes = [
+            # выборка воркером: готовые к запуску по времени запуска
+            models.Index(fields=['status', 'run_at'],
+                         name='posts_job_ready_idx'),
+        ]
+
+    def __str__(self):
+        return '%s #%s' % (self.name, self.pk)
@@ -0,0 +1,237 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorPage(Page):
+    """Страница курсорной пагинации.
+
+    Ведёт себя как обычная `Page`, но вместо номера страницы
+    хранит непрозрачные курсоры на соседние страницы. Запрос к базе
+    выполняется при первом обращении к записям или курсорам, так что
+    закэшированный фрагмент шаблона страницу не вычисляет.
+    """
+
+    def __init__(self, fetch, paginator):
+        self._fetch = fetch
+        super().__init__(None, None, paginator)
+
+    def __repr__(self):
+        return '<CursorPage of %d items>' % len(self.object_list)
+
+    def _evaluate(self):
+        if self._fetch is not None:
+            fetch, self._fetch = self._fetch, None
+            self._object_list, self._next, self._previous = fetch()
+
+    @property
+    def object_list(self):
+        self._evaluate()
+        return self._object_list
+
+    @object_list.setter
+    def object_list(self, value):
+        self._object_list = value
+
+    @property
+    def next_cursor(self):
+        self._evaluate()
+        return self._next
+
+    @property
+    def previous_cursor(self):
+        self._evaluate()
+        return self._previous
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def next_page_number(self):
+        return self.next_cursor
+
+    def previous_page_number(self):
+        return self.previous_cursor
+
+
+class CursorPaginator(Paginator):
+    """Keyset-пагинация по упорядоченному набору полей.
+
+    Вместо `OFFSET n LIMIT k` каждая страница выбирается условием
+    "строго после последней записи предыдущей страницы", поэтому
+    стоимость запроса не зависит от глубины страницы. `COUNT(*)`
+    выполняется только при явном обращении к `count`/`num_pages`.
+    """
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-pk')):
+        self.ordering = tuple(ordering)
+        super().__init__(object_list.order_by(*self.ordering), per_page)
+
+    def get_page(self, cursor):
+        try:
+            values, reverse = self.decode_cursor(cursor)
+        except (TypeError, ValueError, ValidationError):
+            values, reverse = None, False
+        return self.page_after(values, reverse)
+
+    def page(self, cursor):
+        return self.get_page(cursor)
+
+    def iter_pages(self):
+        """Обходит весь набор страницами: память не растёт с размером
+        таблицы, а каждая страница — отдельный короткий запрос."""
+        page = self.get_page(None)
+        while True:
+            yield page
+            if not page.has_next():
+                break
+            page = self.get_page(page.next_cursor)
+
+    def page_after(self, values=None, reverse=False):
+        return CursorPage(lambda: self._fetch(values, reverse), self)
+
+    def prepare_rows(self, rows):
+        """Хук для подклассов: превращает строки выборки в элементы
+        страницы (курсоры считаются по исходным строкам)."""
+        return rows
+
+    def fetch_rows(self, values, reverse, limit):
+        """Хук для подклассов: до `limit` строк строго после `values`
+        в порядке `ordering` (в обратном при `reverse`)."""
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self._invert(field) for field in ordering)
+        queryset = self.object_list.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._keyset_filter(ordering, values))
+        return list(queryset[:limit])
+
+    def _fetch(self, values, reverse):
+        rows = self.fetch_rows(values, reverse, self.per_page + 1)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or (reverse and values is not None):
+                next_cursor = self.encode_cursor(rows[-1])
+            if (not reverse and values is not None) or (reverse and has_more):
+                previous_cursor = self.encode_cursor(rows[0], reverse=True)
+        return self.prepare_rows(rows), next_cursor, previous_cursor
+
+    def encode_cursor(self, obj, reverse=False):
+        values = [self._value(obj, field) for field in self._names()]
+        payload = json.dumps(
+            {'v': values, 'r': int(reverse)}, default=self._json_default,
+            separators=(',', ':'))
+        return base64.urlsafe_b64encode(
+            payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None, False
+        padding = '=' * (-len(cursor) % 4)
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        except (json.JSONDecodeError, UnicodeDecodeError, binascii.Error):
+            raise ValueError('Invalid cursor')
+        names = self._names()
+        if not isinstance(payload, dict) or len(payload.get('v', ())) != len(names):
+            raise ValueError('Invalid cursor')
+        return self.parse_values(names, payload['v']), bool(payload.get('r'))
+
+    def parse_values(self, names, values):
+        opts = self.object_list.model._meta
+        result = []
+        for name, value in zip(names, values):
+            field = opts.pk if name == 'pk' else opts.get_field(name)
+            result.append(field.to_python(value))
+        return result
+
+    def _names(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def _json_default(value):
+        # isoformat() сохраняет микросекунды, иначе курсор "съест" записи
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
+
+    @staticmethod
+    def _value(obj, name):
+        # строки values() из быстрого пути API (posts/fastjson.py)
+        if isinstance(obj, dict):
+            return obj[name]
+        return obj.pk if name == 'pk' else getattr(obj, name)
+
+    @staticmethod
+    def _keyset_filter(ordering, values):
+        condition = Q()
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            step = Q(**{'%s__%s' % (name, lookup): values[index]})
+            for prev_field, prev_value in zip(ordering[:index], values):
+                step &= Q(**{prev_field.lstrip('-'): prev_value})
+            condition |= step
+        return condition
+
+
+class PostCursorPagination(BasePagination):
+    """Курсорная пагинация для REST API поверх `CursorPaginator`."""
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = api_settings.PAGE_SIZE or 20
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate(
+            CursorPaginator(queryset, self.get_page_size(request)), request)
+
+    def paginate(self, paginator, request):
+        """Страница из готового курсорного пагинатора (например, поиска)."""
+        self.request = request
+        self.page = paginator.get_page(
+            request.query_params.get(self.cursor_query_param))
+        return list(self.page)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_data(self, data):
+        return OrderedDict([
+            ('next', self.get_link(self.page.next_cursor)),
+            ('previous', self.get_link(self.page.previous_cursor)),
+            ('results', data),
+        ])
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
@@ -0,0 +1,126 @@
+"""Ограничение частоты запросов.
+
+Корзина токенов на область (`RATE_LIMITS` в настройках) и клиента:
+API-токен, пользователя или IP. Корзина хранится в кэше одним числом —
+моментом, когда она снова наполнится (GCRA). Запрос добавляет к нему
+стоимость одного токена через атомарный `incr`, поэтому проверка
+обходится одной-двумя операциями с кэшем и не пишет в базу.
+
+Строка лимита — `'<число>/<период>'`, период `s`, `m`, `h` или `d`:
+`'30/m'` — 30 запросов подряд, дальше по одному раз в две секунды.
+"""
+import hashlib
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+KEY_PREFIX = 'ratelimit'
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+def get_rate(scope):
+    rate = getattr(settings, 'RATE_LIMITS', {}).get(scope)
+    return parse_rate(rate) if rate else None
+
+
+def client_address(request):
+    """Адрес клиента. `X-Forwarded-For` присылает сам клиент, поэтому он
+    учитывается, только если `REST_FRAMEWORK['NUM_PROXIES']` задаёт
+    число своих прокси перед приложением."""
+    if api_settings.NUM_PROXIES is None:
+        return request.META.get('REMOTE_ADDR')
+    return BaseThrottle().get_ident(request)
+
+
+def client_key(request):
+    """API-токен, иначе вошедший пользователь, иначе адрес клиента."""
+    user = getattr(request, 'user', None)
+    auth = getattr(request, 'auth', None)
+    if auth is not None and hasattr(auth, 'key'):
+        # сам токен в ключ кэша не попадает
+        return 'token:' + hashlib.sha1(auth.key.encode()).hexdigest()
+    if user is not None and user.is_authenticated:
+        return 'user:%s' % user.pk
+    return 'ip:%s' % client_address(request)
+
+
+def take(key, count, period):
+    """Забирает токен из корзины. Возвращает 0, если запрос пропущен,
+    иначе сколько секунд ждать следующего токена."""
+    interval = max(period * 1000 // count, 1)
+    capacity = interval * count
+    now = int(time.time() * 1000)
+    if cache.add(key, now + interval, period):
+        return 0
+    try:
+        full_at = cache.incr(key, interval)
+    except ValueError:
+        # ключ истёк между add и incr
+        cache.set(key, now + interval, period)
+        return 0
+    if full_at - interval < now:
+        # корзина успела наполниться: начинаем отсчёт заново. Гонка здесь
+        # безобидна — она может лишь пропустить пару лишних запросов
+        cache.set(key, now + interval, period)
+        return 0
+    if full_at - now > capacity:
+        cache.decr(key, interval)
+        return (full_at - now - capacity) / 1000
+    # полная корзина равна отсутствующему ключу, так что ключ живёт,
+    # пока она не наполнится
+    cache.touch(key, math.ceil((full_at - now) / 1000))
+    return 0
+
+
+def check(scope, request):
+    rate = get_rate(scope)
+    if rate is None:
+        return 0
+    return take('%s:%s:%s' % (KEY_PREFIX, scope, client_key(request)), *rate)
+
+
+def too_many_requests(wait):
+    response = HttpResponse(
+        'Слишком много запросов, попробуйте позже.', status=429,
+        content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(math.ceil(wait))
+    return response
+
+
+def limit(scope, methods=None):
+    """Декоратор представления: лимит `RATE_LIMITS[scope]` для методов
+    `methods` (по умолчанию для всех)."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if methods is None or request.method in methods:
+                wait = check(scope, request)
+                if wait:
+                    return too_many_requests(wait)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class BucketThrottle(BaseThrottle):
+    """Троттлинг DRF на тех же корзинах. Область — `throttle_scope`
+    представления, по умолчанию `api`. Ответ 429 с `Retry-After`
+    формирует сам DRF."""
+
+    def allow_request(self, request, view):
+        self.delay = check(getattr(view, 'throttle_scope', 'api'), request)
+        return not self.delay
+
+    def wait(self):
+        return self.delay
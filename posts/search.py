@@ -0,0 +1,167 @@
+"""Полнотекстовый поиск по постам.
+
+Индекс — виртуальная таблица SQLite FTS5 `posts_search` (см. миграцию
+0015): одна строка на пост, rowid совпадает с id поста, колонки —
+текст поста, тексты комментариев, название группы и имя автора.
+Индекс обновляется сигналами, ранжирование — BM25 с весами колонок,
+страницы выбираются по курсору (rank, rowid).
+
+На других СУБД FTS5 нет, там поиск сводится к `icontains` по тексту.
+"""
+import re
+from collections import namedtuple
+
+from django.db import connection
+from django.db.models import Q
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+
+from .models import Comment, Post
+from .pagination import CursorPaginator
+
+TABLE = 'posts_search'
+# не больше стольких слов из запроса попадает в MATCH
+MAX_TERMS = 10
+
+Hit = namedtuple('Hit', 'pk rank')
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """Превращает пользовательский ввод в безопасное выражение MATCH:
+    каждое слово — префиксный терм в кавычках, термы через AND."""
+    words = re.findall(r'\w+', query or '')[:MAX_TERMS]
+    return ' '.join('"%s"*' % word for word in words)
+
+
+def _documents(post_ids):
+    comments = {}
+    for post_id, text in Comment.objects.filter(
+            post_id__in=post_ids).order_by('created').values_list(
+                'post_id', 'text'):
+        comments.setdefault(post_id, []).append(text)
+    rows = Post.objects.filter(pk__in=post_ids).values_list(
+        'pk', 'text', 'group__title', 'author__username',
+        'author__first_name', 'author__last_name')
+    for pk, text, group_title, username, first_name, last_name in rows:
+        yield (pk, text, '\n'.join(comments.get(pk, ())), group_title or '',
+               ' '.join(filter(None, (username, first_name, last_name))))
+
+
+def index_posts(post_ids):
+    """Перестраивает строки индекса для перечисленных постов."""
+    post_ids = list(post_ids)
+    if not post_ids:
+        return
+    with connection.cursor() as cursor:
+        remove_posts(post_ids, cursor)
+        cursor.executemany(
+            'INSERT INTO %s (rowid, text, comments, group_title, author) '
+            'VALUES (%%s, %%s, %%s, %%s, %%s)' % TABLE,
+            list(_documents(post_ids)))
+
+
+def remove_posts(post_ids, cursor=None):
+    post_ids = list(post_ids)
+    if cursor is None:
+        with connection.cursor() as cursor:
+            return remove_posts(post_ids, cursor)
+    cursor.execute(
+        'DELETE FROM %s WHERE rowid IN (%s)' % (
+            TABLE, ', '.join(['%s'] * len(post_ids))), post_ids)
+
+
+def rebuild(chunk_size=500):
+    """Переиндексирует все посты, например после `bulk_create`,
+    который обходит сигналы."""
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % TABLE)
+    post_ids = list(Post.objects.values_list('pk', flat=True))
+    for start in range(0, len(post_ids), chunk_size):
+        index_posts(post_ids[start:start + chunk_size])
+
+
+# поля пользователя, из которых складывается имя автора в индексе
+AUTHOR_FIELDS = ('username', 'first_name', 'last_name')
+
+
+def author_name(user):
+    return ' '.join(filter(
+        None, (getattr(user, field) for field in AUTHOR_FIELDS)))
+
+
+def update_author(user):
+    """Новое имя автора во всех его постах — одним UPDATE."""
+    name = author_name(user)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'UPDATE %s SET author = %%s WHERE rowid IN '
+            '(SELECT id FROM posts_post WHERE author_id = %%s)' % TABLE,
+            [name, user.pk])
+
+
+def update_group(group, title=None):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'UPDATE %s SET group_title = %%s WHERE rowid IN '
+            '(SELECT id FROM posts_post WHERE group_id = %%s)' % TABLE,
+            [group.title if title is None else title, group.pk])
+
+
+class SearchPaginator(CursorPaginator):
+    """Курсорная пагинация результатов FTS5 по (rank, rowid).
+
+    `rank` — BM25 с весами колонок, заданными в конфигурации индекса;
+    чем меньше, тем релевантнее.
+    """
+
+    def __init__(self, query, per_page):
+        self.ordering = ('rank', 'pk')
+        self.match = match_expression(query)
+        Paginator.__init__(self, self.match, per_page)
+
+    @cached_property
+    def count(self):
+        if not self.match:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT count(*) FROM %s WHERE %s MATCH %%s' % (TABLE, TABLE),
+                [self.match])
+            return cursor.fetchone()[0]
+
+    def fetch_rows(self, values, reverse, limit):
+        if not self.match:
+            return []
+        sign, direction = ('<', 'DESC') if reverse else ('>', 'ASC')
+        sql = 'SELECT rowid, rank FROM %s WHERE %s MATCH %%s' % (TABLE, TABLE)
+        params = [self.match]
+        if values is not None:
+            sql += ' AND (rank %s %%s OR (rank = %%s AND rowid %s %%s))' % (
+                sign, sign)
+            params += [values[0], values[0], values[1]]
+        sql += ' ORDER BY rank %s, rowid %s LIMIT %%s' % (direction, direction)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + [limit])
+            return [Hit(*row) for row in cursor.fetchall()]
+
+    def parse_values(self, names, values):
+        return [float(values[0]), int(values[1])]
+
+    def prepare_rows(self, rows):
+        posts = Post.objects.feed().in_bulk([hit.pk for hit in rows])
+        return [posts[hit.pk] for hit in rows if hit.pk in posts]
+
+
+def paginator(query, per_page):
+    if available():
+        return SearchPaginator(query, per_page)
+    words = re.findall(r'\w+', query or '')[:MAX_TERMS]
+    condition = Q()
+    for word in words:
+        condition &= Q(text__icontains=word)
+    posts = Post.objects.feed().filter(condition) if words else Post.objects.none()
+    return CursorPaginator(posts, per_page)
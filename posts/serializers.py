@@ -1,9 +1,129 @@
 from rest_framework import serializers
-from .models import Post
+from .models import Comment, Group, Post, PostImageVariant, User
+
+
+class PostImageVariantSerializer(serializers.ModelSerializer):
+    url = serializers.FileField(source='file', read_only=True)
+
+    class Meta:
+        fields = ('width', 'height', 'format', 'url')
+        model = PostImageVariant
+
+
+class AuthorSerializer(serializers.ModelSerializer):
+    class Meta:
+        fields = ('id', 'username', 'first_name', 'last_name')
+        model = User
+
+
+class GroupSerializer(serializers.ModelSerializer):
+    class Meta:
+        fields = ('id', 'title', 'slug')
+        model = Group
+
+
+class ReplySerializer(serializers.ModelSerializer):
+    author = serializers.SlugRelatedField(
+        slug_field='username', read_only=True)
+
+    class Meta:
+        fields = ('id', 'author', 'text', 'created', 'parent')
+        model = Comment
+
+
+class CommentSerializer(ReplySerializer):
+    """Корневой комментарий с ответами из `CommentPaginator`."""
+    replies = ReplySerializer(
+        source='thread_replies', many=True, read_only=True)
+
+    class Meta(ReplySerializer.Meta):
+        fields = ReplySerializer.Meta.fields + ('replies',)
 
 
 class PostSerializer(serializers.ModelSerializer):
+    """Пост. `fields` оставляет только перечисленные поля, `expand`
+    встраивает автора и группу объектами и добавляет `comments_count`;
+    `prepare_queryset` выбирает из базы ровно то, что нужно для них."""
+    image_variants = PostImageVariantSerializer(many=True, read_only=True)
+
+    EXPANDABLE = ('author', 'group', 'comments_count')
+    # колонки Post, без которых поле не вывести
+    COLUMNS = {
+        'id': ('id',),
+        'text': ('text',),
+        'author': ('author',),
+        'image': ('image',),
+        'pub_date': ('pub_date',),
+        'image_variants': (),
+        'group': ('group',),
+        'comments_count': ('comments_count',),
+    }
+    RELATED = {
+        'author': ('author__id', 'author__username', 'author__first_name',
+                   'author__last_name'),
+        'group': ('group__id', 'group__title', 'group__slug'),
+    }
+
     class Meta:
-        fields = ('id', 'text', 'author', 'image', 'pub_date')
+        fields = ('id', 'text', 'author', 'image', 'pub_date',
+                  'image_variants')
         model = Post
         # read_only_fields = ['author']
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = set(expand or ())
+        if 'author' in expand:
+            self.fields['author'] = AuthorSerializer(read_only=True)
+        if 'group' in expand:
+            self.fields['group'] = GroupSerializer(read_only=True)
+        if 'comments_count' in expand:
+            self.fields['comments_count'] = serializers.IntegerField(
+                read_only=True)
+        if fields:
+            for name in set(self.fields) - set(fields) - expand:
+                self.fields.pop(name)
+
+    @classmethod
+    def parse_params(cls, query_params):
+        """(fields, expand) из `?fields=a,b&expand=author`."""
+        fields = _split(query_params.get('fields'))
+        expand = _split(query_params.get('expand'))
+        unknown = (set(fields) - set(cls.Meta.fields) - set(cls.EXPANDABLE)
+                   ) | (set(expand) - set(cls.EXPANDABLE))
+        if unknown:
+            raise serializers.ValidationError(
+                'Unknown fields: %s' % ', '.join(sorted(unknown)))
+        return fields, expand
+
+    @classmethod
+    def prepare_queryset(cls, queryset, fields=None, expand=None):
+        """`only()` по выводимым полям (плюс pub_date для курсора),
+        JOIN только для встраиваемых связей."""
+        expand = set(expand or ())
+        names = set(fields or cls.Meta.fields) | expand
+        columns = {'id', 'pub_date'}
+        for name in names:
+            columns.update(cls.COLUMNS[name])
+        related = [name for name in cls.RELATED if name in expand]
+        for name in related:
+            columns.update(cls.RELATED[name])
+        queryset = queryset.select_related(None).prefetch_related(None)
+        if related:
+            queryset = queryset.select_related(*related)
+        queryset = queryset.only(*columns)
+        if 'image_variants' in names:
+            queryset = queryset.prefetch_related('image_variants')
+        return queryset
+
+
+def _split(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+class PostBulkSerializer(PostSerializer):
+    """Для пакетной загрузки: автор — всегда текущий пользователь,
+    поэтому поле не проверяется запросом к базе на каждый пост."""
+
+    class Meta(PostSerializer.Meta):
+        read_only_fields = ('author',)
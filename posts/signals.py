@@ -0,0 +1,304 @@
+import threading
+
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save)
+from django.db import transaction
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import (
+    authentication, caching, counters, groups, live, search, thumbnails,
+    timeline)
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+
+
+_pending = threading.local()
+
+
+class CommitQueue(set):
+    """id, накопленные за транзакцию; сам себя вызывает по коммиту."""
+
+    def __init__(self, func):
+        super().__init__()
+        self.func = func
+
+    def __call__(self):
+        queues = _pending.queues
+        if queues.get(self.func) is self:
+            del queues[self.func]
+        self.func(set(self))
+
+
+def once_on_commit(func, *ids):
+    """Копит id до коммита и вызывает `func(ids)` один раз на всю
+    транзакцию, а не на каждую строку (каскадное удаление поста с
+    тысячами комментариев). Вне транзакции вызывает сразу.
+
+    Возвращает id, которых в очереди этой транзакции ещё не было."""
+    queues = getattr(_pending, 'queues', None)
+    if queues is None:
+        queues = _pending.queues = {}
+    queue = queues.get(func)
+    connection = transaction.get_connection()
+    if queue is None or not any(
+            callback is queue for sids, callback in connection.run_on_commit):
+        # первая строка транзакции; очередь откаченной транзакции или
+        # точки сохранения пропала вместе со своим колбэком
+        queue = queues[func] = CommitQueue(func)
+        queue.update(ids)
+        transaction.on_commit(queue)
+        return set(ids)
+    new = set(ids) - queue
+    queue.update(ids)
+    return new
+
+
+# Посты и пользователи, которые сейчас удаляются: pre_delete приходит
+# для всех объектов каскада до удаления первого из них, так что
+# обработчики дочерних строк не трогают счётчики и кэш родителя,
+# который всё равно исчезнет
+_deleting = threading.local()
+
+
+def deleting(model):
+    sets = getattr(_deleting, 'sets', None)
+    if sets is None:
+        sets = _deleting.sets = {}
+    return sets.setdefault(model, set())
+
+
+@receiver(pre_delete, sender=Post)
+@receiver(pre_delete, sender=User)
+def remember_deleting(sender, instance, **kwargs):
+    deleting(sender).add(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=User)
+def forget_deleting(sender, instance, **kwargs):
+    deleting(sender).discard(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if created:
+        timeline.fan_out_post(instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        timeline.add_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    timeline.remove_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_changed(sender, instance, **kwargs):
+    # счётчики подписок и кнопка подписки на страницах обоих авторов
+    caching.bump_on_commit(caching.author_scope(instance.author_id),
+                           caching.author_scope(instance.user_id))
+
+
+@receiver(pre_save, sender=Post)
+def post_remember_group(sender, instance, **kwargs):
+    # при смене группы нужно сбросить кэш и старой группы, а превью
+    # готовить заново, только если сменилась картинка
+    if instance.pk is not None:
+        instance._previous_group_id, instance._previous_image = (
+            Post.objects.filter(pk=instance.pk).values_list(
+                'group_id', 'image').first() or (None, None))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    caching.bump_on_commit(*caching.post_scopes(
+        instance, getattr(instance, '_previous_group_id', None)))
+
+
+def bump_posts(post_ids):
+    scopes = set()
+    for post in Post.objects.filter(pk__in=post_ids).only(
+            'author_id', 'group_id'):
+        scopes |= caching.post_scopes(post)
+    if scopes:
+        caching.bump(*scopes)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    # пост удаляется каскадом — кэш сбросит его собственный сигнал
+    if instance.post_id in deleting(Post):
+        return
+    # как bump_on_commit, но сразу — только на первый комментарий поста
+    # в транзакции, после коммита — один раз на все посты
+    new = once_on_commit(bump_posts, instance.post_id)
+    if new and transaction.get_connection().in_atomic_block:
+        bump_posts(new)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    # версия справочника групп — тоже поколение GLOBAL
+    caching.bump_on_commit(caching.GLOBAL)
+    groups.clear()
+    transaction.on_commit(groups.clear)
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, **kwargs):
+    if created:
+        AuthorStats.objects.get_or_create(user=instance)
+    elif kwargs.get('update_fields') != frozenset(['last_login']):
+        # имя автора выводится в карточках его постов
+        caching.bump_on_commit(caching.author_scope(instance.pk))
+
+
+@receiver(post_save, sender=Post)
+def post_count_created(sender, instance, created, **kwargs):
+    if created:
+        counters.change_author_stats(instance.author_id, posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def post_count_deleted(sender, instance, **kwargs):
+    if instance.author_id not in deleting(User):
+        counters.change_author_stats(instance.author_id, posts_count=-1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_count_created(sender, instance, created, **kwargs):
+    if created:
+        counters.change_comments_count(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_count_deleted(sender, instance, **kwargs):
+    if instance.post_id not in deleting(Post):
+        counters.change_comments_count(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_count_created(sender, instance, created, **kwargs):
+    if created:
+        counters.change_author_stats(instance.author_id, followers_count=1)
+        counters.change_author_stats(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_count_deleted(sender, instance, **kwargs):
+    users = deleting(User)
+    if instance.author_id not in users:
+        counters.change_author_stats(instance.author_id, followers_count=-1)
+    if instance.user_id not in users:
+        counters.change_author_stats(instance.user_id, following_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def post_image_saved(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_image', None) or ''
+    if created or previous != (instance.image.name or ''):
+        thumbnails.enqueue(instance, created)
+
+
+@receiver(post_save, sender=Post)
+def post_search_saved(sender, instance, **kwargs):
+    if search.available():
+        search.index_posts([instance.pk])
+
+
+@receiver(post_delete, sender=Post)
+def post_search_deleted(sender, instance, **kwargs):
+    if search.available():
+        search.remove_posts([instance.pk])
+
+
+def reindex_posts(post_ids):
+    # удалённые к коммиту посты index_posts просто уберёт из индекса
+    search.index_posts(post_ids)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_search_changed(sender, instance, **kwargs):
+    # строка поста собирается из всех его комментариев, поэтому
+    # пересобирается один раз за транзакцию
+    if search.available():
+        once_on_commit(reindex_posts, instance.post_id)
+
+
+def author_name_saved(update_fields):
+    return update_fields is None or not set(
+        search.AUTHOR_FIELDS).isdisjoint(update_fields)
+
+
+@receiver(pre_save, sender=User)
+def user_remember_name(sender, instance, update_fields=None, **kwargs):
+    # индекс переписывается, только если имя автора изменилось, а не
+    # при каждом сохранении (вход пользователя обновляет last_login)
+    instance._previous_author_name = None
+    if (instance.pk is not None and author_name_saved(update_fields)
+            and search.available()):
+        previous = User.objects.filter(pk=instance.pk).only(
+            *search.AUTHOR_FIELDS).first()
+        if previous is not None:
+            instance._previous_author_name = search.author_name(previous)
+
+
+@receiver(post_save, sender=User)
+def user_search_changed(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_author_name', None)
+    if (not created and previous is not None
+            and previous != search.author_name(instance)):
+        search.update_author(instance)
+
+
+@receiver(post_save, sender=Group)
+def group_search_changed(sender, instance, created, **kwargs):
+    if not created and search.available():
+        search.update_group(instance)
+
+
+@receiver(pre_delete, sender=Group)
+def group_search_deleted(sender, instance, **kwargs):
+    # посты отвяжутся от группы через SET_NULL без сигналов
+    if search.available():
+        search.update_group(instance, title='')
+
+
+@receiver(post_save, sender=Post)
+def post_publish_live(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: live.publish_post(instance))
+
+
+def forget_tokens(*keys):
+    # и сразу, и после коммита: иначе параллельный запрос может вернуть
+    # в кэш строку, которую транзакция ещё не успела поменять
+    authentication.forget(*keys)
+    transaction.on_commit(lambda: authentication.forget(*keys))
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_changed(sender, instance, created=False, **kwargs):
+    if not created:
+        forget_tokens(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_token_changed(sender, instance, created, **kwargs):
+    # в кэше токена лежит и пользователь, включая is_active
+    if not created and kwargs.get('update_fields') != frozenset(
+            ['last_login']):
+        keys = list(Token.objects.filter(
+            user=instance).values_list('key', flat=True))
+        if keys:
+            forget_tokens(*keys)
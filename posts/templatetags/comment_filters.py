@@ -5,3 +5,10 @@ register = template.Library()
 @register.filter
 def addUserClass(field, css):
     return field.as_widget(attrs={"class": css})
+
+
+@register.simple_tag
+def reply_field(field, css, thread_id):
+    """Поле формы ответа: у каждой ветки на странице свой id."""
+    return field.as_widget(
+        attrs={"class": css, "id": "%s_%s" % (field.auto_id, thread_id)})
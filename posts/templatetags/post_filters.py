@@ -1,7 +1,29 @@
 from django import template
+
+from posts import groups
+from posts.thumbnails import SIZES, srcsets, thumbnail_url
+
 register = template.Library()
 
 
 @register.filter
 def addPostClass(field, css):
     return field.as_widget(attrs={"class": css})
+
+
+@register.inclusion_tag('includes/post_image.html')
+def post_image(post):
+    sources = srcsets(post)
+    webp = sources.pop('WEBP', '')
+    return {
+        'src': thumbnail_url(post.image),
+        'srcset': next(iter(sources.values()), ''),
+        'webp_srcset': webp,
+        'sizes': SIZES,
+    }
+
+
+@register.simple_tag
+def post_group(post):
+    """Группа поста из справочника, без запроса к базе."""
+    return groups.get(post.group_id) if post.group_id else None
@@ -1,11 +1,46 @@
-from django.test import TestCase, Client, override_settings
+import asyncio
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
-from .models import Post, User, Group, Follow, Comment
+from django.utils import timezone
+from .models import (
+    AuthorStats, Comment, Follow, Group, Job, Post, PostImageVariant,
+    TimelineEntry, User)
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from io import BytesIO
+from io import BytesIO, StringIO
+from django.core.management import call_command
 from PIL import Image
 from django.core.files.base import File
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework.authtoken.models import Token
+from rest_framework.response import Response
+from yatube import db, metrics, routers
+from . import (
+    caching, comments, fastjson, groups, jobs, live, ratelimit, search, thumbnails,
+    views)
+from .forms import PostForm
+from .pagination import CursorPaginator
+
+
+def run_commit_callbacks(start=0):
+    """Выполняет колбэки on_commit, накопленные внутри транзакции
+    TestCase, как будто она закоммичена."""
+    callbacks = connection.run_on_commit[start:]
+    del connection.run_on_commit[start:]
+    for sids, callback in callbacks:
+        callback()
 
 
 class YatubeTest(TestCase):
@@ -208,14 +243,1461 @@ class YatubeTest(TestCase):
             'add_comment', args=[second_user.username, post.id]))
 
     def test_page_cached(self):
+        cache.clear()
         post_text = 'Test post text'
         post_new_text = 'Test post new text'
         self.post = Post.objects.create(
             text=post_text, author=self.user, group=self.group)
-        response = self.client.get('/')
-        post1 = response.context.get('page')[0]
+        self.client.get('/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/')
+        self.assertContains(response, post_text)
+        self.assertFalse(
+            [q for q in queries if 'posts_post' in q['sql']],
+            'Закэшированная страница не должна выбирать посты')
+
         self.client.post(reverse("post_edit", args=[self.user, self.post.id]), {
             'text': post_new_text, 'group': self.group.id}, follow=True)
-        response = self.client.get('/')
-        post2 = response.context.get('page')[0]
-        self.assertEqual(post1.text, post2.text)
+        for url in ('/', reverse('group_posts', args=[self.group.slug]),
+                    reverse('profile', args=[self.user])):
+            self.assertContains(self.client.get(url), post_new_text)
+
+    def test_generation_bumped_again_on_commit(self):
+        cache.clear()
+        callbacks = []
+        with mock.patch('posts.signals.transaction.on_commit',
+                        callbacks.append):
+            Post.objects.create(text='text', author=self.user)
+        # параллельный запрос до коммита уже видел новое поколение
+        seen = caching.get_versions(caching.POSTS)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(caching.get_versions(caching.POSTS), seen)
+
+    def test_page_cache_varies_on_scope(self):
+        cache.clear()
+        other_group = Group.objects.create(title='Other', slug='other')
+        other_user = User.objects.create_user(username="other_author")
+        Post.objects.create(text='first group post', author=self.user,
+                            group=self.group)
+        Post.objects.create(text='second group post', author=other_user,
+                            group=other_group)
+        # одно и то же поколение у всех областей
+        caching.bump(caching.group_scope(self.group.pk),
+                     caching.group_scope(other_group.pk),
+                     caching.author_scope(self.user.pk),
+                     caching.author_scope(other_user.pk))
+        for first, second in (
+                (reverse('group_posts', args=[self.group.slug]),
+                 reverse('group_posts', args=[other_group.slug])),
+                (reverse('profile', args=[self.user]),
+                 reverse('profile', args=[other_user]))):
+            self.assertContains(self.client_no_auth.get(first),
+                                'first group post')
+            response = self.client_no_auth.get(second)
+            self.assertContains(response, 'second group post')
+            self.assertNotContains(response, 'first group post')
+
+    def test_comment_cascade_is_not_per_row(self):
+        def delete_queries(count):
+            post = Post.objects.create(text='text', author=self.user)
+            for i in range(count):
+                Comment.objects.create(
+                    post=post, author=self.user, text='comment %d' % i)
+            with CaptureQueriesContext(connection) as queries:
+                post.delete()
+            return len(queries)
+
+        self.assertEqual(delete_queries(20), delete_queries(2))
+
+    def test_comments_bump_once_per_transaction(self):
+        post = Post.objects.create(text='text', author=self.user)
+        start = len(connection.run_on_commit)
+        with mock.patch.object(caching, 'bump') as bump:
+            for i in range(3):
+                Comment.objects.create(
+                    post=post, author=self.user, text='comment %d' % i)
+            # сразу — только на первый комментарий
+            self.assertEqual(bump.call_count, 1)
+            run_commit_callbacks(start)
+            self.assertEqual(bump.call_count, 2)
+
+    def test_page_cache_varies_on_user(self):
+        cache.clear()
+        self.post = Post.objects.create(text='text', author=self.user)
+        edit_url = reverse('post_edit', args=[self.user, self.post.id])
+        self.assertContains(self.client.get('/'), edit_url)
+        self.assertNotContains(self.client_no_auth.get('/'), edit_url)
+
+    def test_page_cache_invalidated_by_comment_and_group(self):
+        cache.clear()
+        post = Post.objects.create(
+            text='text', author=self.user, group=self.group)
+        self.client.get('/')
+        Comment.objects.create(post=post, author=self.user, text='comment')
+        self.assertContains(self.client.get('/'), '1 комментариев')
+        self.group.title = 'Renamed group'
+        self.group.save()
+        self.assertContains(self.client.get('/'), 'Renamed group')
+
+
+class CursorPaginatorTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="pager", email="pager@mail.com", password="12345")
+        for i in range(25):
+            Post.objects.create(text='post %s' % i, author=self.user)
+        # Половина постов с одинаковой датой, чтобы проверить разрешение по id
+        Post.objects.filter(pk__in=Post.objects.values('pk')[:12]).update(
+            pub_date=Post.objects.first().pub_date)
+
+    def test_walk_forward_and_back(self):
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        expected = list(Post.objects.order_by('-pub_date', '-pk'))
+        page = paginator.get_page(None)
+        self.assertFalse(page.has_previous())
+        pages = [page]
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            pages.append(page)
+        self.assertEqual([len(p) for p in pages], [10, 10, 5])
+        self.assertEqual([post for p in pages for post in p], expected)
+
+        back = paginator.get_page(pages[-1].previous_cursor)
+        self.assertEqual(list(back), list(pages[1]))
+        back = paginator.get_page(back.previous_cursor)
+        self.assertEqual(list(back), list(pages[0]))
+        self.assertFalse(back.has_previous())
+        self.assertTrue(back.has_next())
+
+    def test_invalid_cursor_returns_first_page(self):
+        first_page = list(Post.objects.order_by('-pub_date', '-pk')[:10])
+        # мусор и корректный base64 с неверными значениями
+        for cursor in ('garbage!', 'eyJ2IjpbImJhZCIsMV0sInIiOjB9'):
+            response = self.client.get(reverse('index'), {'cursor': cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(list(response.context['page']), first_page)
+
+    def test_next_link_rendered(self):
+        response = self.client.get(reverse('index'))
+        page = response.context['page']
+        self.assertContains(response, '?cursor=%s' % page.next_cursor)
+        response = self.client.get(
+            reverse('profile', args=[self.user.username]),
+            {'cursor': page.next_cursor})
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache', }
+})
+class FeedQueriesTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.group = Group.objects.create(title='Group', slug='group')
+        self.user = User.objects.create_user(
+            username="reader", email="reader@mail.com", password="12345")
+        self.client.force_login(self.user)
+
+    def add_posts(self, count):
+        for i in range(count):
+            author = User.objects.create_user(username='author%s_%s' % (
+                count, i))
+            Follow.objects.create(user=self.user, author=author)
+            post = Post.objects.create(
+                text='text', author=author, group=self.group)
+            Comment.objects.create(post=post, author=author, text='comment')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_feed_queries_do_not_grow_with_posts(self):
+        urls = [
+            reverse('index'),
+            reverse('group_posts', args=[self.group.slug]),
+            reverse('follow_index'),
+        ]
+        self.add_posts(1)
+        baseline = [self.count_queries(url) for url in urls]
+        self.add_posts(9)
+        self.assertEqual([self.count_queries(url) for url in urls], baseline)
+
+    def test_comments_count_annotation(self):
+        self.add_posts(1)
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['page'][0].comments_count, 1)
+        self.assertContains(response, '1 комментариев')
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="follower", email="follower@mail.com", password="12345")
+        self.author = User.objects.create_user(
+            username="writer", email="writer@mail.com", password="12345")
+        self.client.force_login(self.user)
+
+    def timeline(self):
+        return list(TimelineEntry.objects.filter(
+            user=self.user).values_list('post_id', flat=True))
+
+    def test_follow_and_new_post_fill_timeline(self):
+        old_post = Post.objects.create(text='old', author=self.author)
+        self.client.get(reverse('profile_follow', args=[self.author]))
+        self.assertEqual(self.timeline(), [old_post.id])
+
+        new_post = Post.objects.create(text='new', author=self.author)
+        self.assertCountEqual(self.timeline(), [old_post.id, new_post.id])
+        response = self.client.get(reverse('follow_index'))
+        self.assertEqual(list(response.context['page']), [new_post, old_post])
+
+        self.client.get(reverse('profile_unfollow', args=[self.author]))
+        self.assertEqual(self.timeline(), [])
+
+    def test_backfill_command(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(text='text', author=self.author)
+        TimelineEntry.objects.all().delete()
+        call_command('backfill_timeline', stdout=StringIO())
+        self.assertEqual(self.timeline(), [post.id])
+
+
+class APIPostListTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="apiuser", email="api@mail.com", password="12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.posts = [Post.objects.create(text='post %s' % i, author=self.user)
+                      for i in range(7)]
+        self.expected = [post.id for post in reversed(self.posts)]
+
+    def test_cursor_pagination(self):
+        url = '/api/v1/posts/?page_size=3'
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 3)
+            ids += [item['id'] for item in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, self.expected)
+
+    def test_page_size_is_clamped(self):
+        response = self.client.get('/api/v1/posts/', {'page_size': 0})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['previous'])
+
+    def test_ndjson_stream(self):
+        with mock.patch.object(views, 'STREAM_CHUNK_SIZE', 2):
+            response = self.client.get('/api/v1/posts/', {'stream': 1})
+            lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            [json.loads(line)['id'] for line in lines], self.expected)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache', }
+})
+class QueryPlanTest(TestCase):
+    """Горячие пути не должны сканировать таблицу и сортировать результат."""
+
+    def setUp(self):
+        self.client = Client()
+        self.group = Group.objects.create(title='Group', slug='group')
+        self.user = User.objects.create_user(
+            username="planner", email="planner@mail.com", password="12345")
+        self.author = User.objects.create_user(username="planned")
+        Follow.objects.create(user=self.user, author=self.author)
+        for i in range(15):
+            post = Post.objects.create(
+                text='text', author=self.author, group=self.group)
+            Comment.objects.create(post=post, author=self.user, text='c')
+        self.post = post
+        self.client.force_login(self.user)
+
+    def query_plans(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                if not query['sql'].startswith('SELECT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plans.append((query['sql'], [row[-1] for row in cursor]))
+        return plans, response
+
+    def test_feeds_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN есть только в SQLite')
+        urls = [
+            reverse('index'),
+            reverse('group_posts', args=[self.group.slug]),
+            reverse('profile', args=[self.author.username]),
+            reverse('follow_index'),
+            reverse('post_view', args=[self.author.username, self.post.id]),
+        ]
+        for url in urls:
+            plans, response = self.query_plans(url)
+            page = response.context.get('page')
+            if page is not None and page.has_next():
+                plans += self.query_plans(url, {'cursor': page.next_cursor})[0]
+            for sql, plan in plans:
+                if 'posts_' not in sql:
+                    continue
+                with self.subTest(url=url, sql=sql):
+                    self.assertFalse(
+                        [step for step in plan if 'TEMP B-TREE' in step],
+                        plan)
+                    self.assertFalse(
+                        [step for step in plan
+                         if step.startswith('SCAN') and 'INDEX' not in step
+                         and step != 'SCAN subquery'],
+                        plan)
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="counted", email="counted@mail.com", password="12345")
+        self.author = User.objects.create_user(username="counted_author")
+        self.client.force_login(self.user)
+
+    def stats(self, user):
+        return AuthorStats.objects.values_list(
+            'posts_count', 'followers_count', 'following_count').get(user=user)
+
+    def test_counters_follow_changes(self):
+        post = Post.objects.create(text='text', author=self.author)
+        self.client.get(reverse('profile_follow', args=[self.author]))
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='comment')
+        self.assertEqual(self.stats(self.author), (1, 1, 0))
+        self.assertEqual(self.stats(self.user), (0, 0, 1))
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+        comment.delete()
+        self.client.get(reverse('profile_unfollow', args=[self.author]))
+        post.delete()
+        self.assertEqual(self.stats(self.author), (0, 0, 0))
+        self.assertEqual(self.stats(self.user), (0, 0, 0))
+
+    def test_edit_keeps_concurrent_comment(self):
+        post = Post.objects.create(text='text', author=self.user)
+        loaded = Post.objects.get(pk=post.pk)
+        Comment.objects.create(post=post, author=self.user, text='comment')
+        loaded.text = 'edited'
+        loaded.save()
+        self.client.post(
+            reverse('post_edit', args=[self.user.username, post.pk]),
+            {'text': 'edited again'})
+        post.refresh_from_db()
+        self.assertEqual((post.text, post.comments_count),
+                         ('edited again', 1))
+
+    def test_cascade_skips_deleted_parents(self):
+        post = Post.objects.create(text='text', author=self.author)
+        Comment.objects.bulk_create([Comment(
+            post=post, author=self.user, text='comment %d' % i)
+            for i in range(3)])
+        # bulk_create обошёл сигналы: счётчик разошёлся с данными
+        Comment.objects.create(post=post, author=self.user, text='last')
+        Post.objects.create(text='other', author=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            post.delete()
+        self.assertFalse(
+            [q for q in queries if 'comments_count' in q['sql']])
+        self.assertEqual(self.stats(self.author), (0, 0, 0))
+
+        self.user.delete()
+        self.assertEqual(self.stats(self.author), (0, 0, 0))
+
+    def test_decrement_is_clamped(self):
+        post = Post.objects.create(text='text', author=self.author)
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='comment')
+        Post.objects.update(comments_count=0)
+        AuthorStats.objects.update(posts_count=0)
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        post.delete()
+        self.assertEqual(self.stats(self.author), (0, 0, 0))
+
+    def test_profile_shows_counters_without_count_queries(self):
+        Post.objects.create(text='text', author=self.author)
+        Follow.objects.create(user=self.user, author=self.author)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('profile', args=[self.author]))
+        self.assertContains(response, 'Подписчиков: 1')
+        self.assertContains(response, 'Записей:1')
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql']])
+
+    def test_recount_command(self):
+        post = Post.objects.create(text='text', author=self.author)
+        Comment.objects.create(post=post, author=self.user, text='comment')
+        Follow.objects.create(user=self.user, author=self.author)
+        AuthorStats.objects.update(
+            posts_count=7, followers_count=7, following_count=7)
+        Post.objects.update(comments_count=7)
+        AuthorStats.objects.filter(user=self.user).delete()
+        call_command('recount_stats', stdout=StringIO())
+        self.assertEqual(self.stats(self.author), (1, 1, 0))
+        self.assertEqual(self.stats(self.user), (0, 0, 1))
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache', }
+})
+class ThumbnailTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(
+            username="painter", email="painter@mail.com", password="12345")
+        file_obj = BytesIO()
+        Image.new('RGB', (40, 20), color=(0, 128, 0)).save(file_obj, 'png')
+        self.post = Post.objects.create(
+            text='picture', author=self.user,
+            image=SimpleUploadedFile('picture.png', file_obj.getvalue()))
+
+    def test_original_shown_until_thumbnail_ready(self):
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'src="%s"' % self.post.image.url)
+
+        thumbnails.generate(self.post.image.name)
+        response = self.client.get(reverse('index'))
+        self.assertNotContains(response, 'src="%s"' % self.post.image.url)
+        self.assertContains(response, 'src="/media/cache/')
+
+    def test_enqueue_skips_missing_files(self):
+        with mock.patch.object(thumbnails, 'process') as process, \
+                self.settings(THUMBNAIL_ASYNC=False):
+            thumbnails.enqueue(self.post)
+            self.post.image.name = 'posts/missing.png'
+            thumbnails.enqueue(self.post)
+        process.assert_called_once_with(self.post.pk, mock.ANY)
+
+    def test_text_edit_keeps_thumbnails(self):
+        with mock.patch.object(thumbnails, 'enqueue') as enqueue:
+            self.post.text = 'new text'
+            self.post.save()
+            enqueue.assert_not_called()
+            self.post.image = None
+            self.post.save()
+            enqueue.assert_called_once_with(self.post, False)
+
+    def test_job_queue(self):
+        with self.settings(THUMBNAIL_QUEUE='jobs'):
+            thumbnails.enqueue(self.post)
+        job = Job.objects.get()
+        self.assertEqual(job.name, 'thumbnails.process')
+        self.assertTrue(jobs.run_next('w1'))
+        self.assertTrue(
+            PostImageVariant.objects.filter(post=self.post).exists())
+
+    def test_variants_srcset_and_api(self):
+        thumbnails.process(self.post.pk, self.post.image.name)
+        formats = thumbnails.variant_formats(self.post.image.name)
+        variants = PostImageVariant.objects.filter(post=self.post)
+        self.assertEqual(
+            variants.count(), len(formats) * len(thumbnails.VARIANT_WIDTHS))
+        self.assertEqual(
+            set(variants.values_list('format', flat=True)), set(formats))
+
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'srcset=', count=len(formats))
+        self.assertContains(response, ' 320w', count=len(formats))
+
+        api = APIClient()
+        api.force_authenticate(self.user)
+        data = api.get('/api/v1/posts/%d/' % self.post.pk).data
+        self.assertEqual(
+            sorted((v['format'], v['width']) for v in data['image_variants']),
+            sorted((v.format, v.width) for v in variants))
+
+        self.post.image = None
+        self.post.save()
+        self.assertFalse(
+            PostImageVariant.objects.filter(post=self.post).exists())
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.client = Client()
+        self.admin = User.objects.create_user(
+            username="staff", email="staff@mail.com", password="12345",
+            is_staff=True)
+        Post.objects.create(text='text', author=self.admin)
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('profile', args=[self.admin.username]))
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('yatube_request_duration_seconds_count{view="index"} 1',
+                      body)
+        self.assertIn('yatube_sql_queries_count{view="profile"} 1', body)
+        self.assertIn('yatube_template_render_seconds_sum{view="index"}', body)
+        self.assertIn('yatube_cache_misses_total{view="index"}', body)
+        sql_count = metrics.registry.histograms['yatube_sql_queries'][1]
+        self.assertGreater(sql_count['index'].sum, 0)
+
+    def test_metrics_require_staff(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with self.settings(METRICS_TOKEN='secret'):
+            response = self.client.get(
+                reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_slow_requests_are_logged(self):
+        with self.settings(METRICS_SLOW_REQUEST_MS=0), \
+                self.assertLogs('yatube.metrics', 'WARNING') as logs:
+            self.client.get(reverse('index'))
+        self.assertIn('Slow request GET / (index)', logs.output[0])
+        self.assertIn('posts_post', logs.output[0])
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(
+            username="writer", first_name="Лев", last_name="Толстой")
+        self.group = Group.objects.create(title='Фантастика', slug='fantasy')
+
+    def found(self, query):
+        paginator = search.paginator(query, 100)
+        return [post.pk for post in paginator.get_page(None)]
+
+    def test_index_follows_changes(self):
+        post = Post.objects.create(
+            text='Космические корабли', author=self.author, group=self.group)
+        other = Post.objects.create(text='Про котов', author=self.author)
+        self.assertEqual(self.found('корабли'), [post.pk])
+        self.assertEqual(self.found('космич'), [post.pk])
+        self.assertEqual(self.found('фантастика'), [post.pk])
+        self.assertCountEqual(self.found('Толстой'), [post.pk, other.pk])
+
+        with mock.patch('posts.signals.transaction.on_commit',
+                        lambda callback: callback()):
+            comment = Comment.objects.create(
+                post=other, author=self.author, text='пушистые')
+            self.assertEqual(self.found('пушистые'), [other.pk])
+            comment.delete()
+            self.assertEqual(self.found('пушистые'), [])
+
+        self.author.last_name = 'Чехов'
+        self.author.save()
+        self.assertEqual(self.found('Толстой'), [])
+        self.group.delete()
+        self.assertEqual(self.found('фантастика'), [])
+        post.delete()
+        self.assertEqual(self.found('корабли'), [])
+
+    def test_comments_reindexed_once_per_transaction(self):
+        post = Post.objects.create(text='Пост', author=self.author)
+        post_id = post.pk
+        start = len(connection.run_on_commit)
+        with mock.patch.object(search, 'index_posts') as index_posts:
+            for text in ('первый', 'второй', 'третий'):
+                Comment.objects.create(
+                    post=post, author=self.author, text=text)
+            post.delete()
+            index_posts.assert_not_called()
+            run_commit_callbacks(start)
+        index_posts.assert_called_once_with({post_id})
+
+    def test_author_reindexed_only_on_rename(self):
+        self.author.set_password('secret')
+        self.author.save()
+        with mock.patch.object(search, 'update_author') as update_author:
+            self.client.login(username='writer', password='secret')
+            self.author.email = 'writer@example.com'
+            self.author.save()
+            update_author.assert_not_called()
+            self.author.first_name = 'Антон'
+            self.author.save(update_fields=['first_name'])
+            update_author.assert_called_once_with(self.author)
+
+    def test_ranking_and_cursor(self):
+        posts = [Post.objects.create(text='чай ' * count, author=self.author)
+                 for count in range(1, 6)]
+        Post.objects.create(text='кофе', author=self.author)
+        paginator = search.paginator('чай', 2)
+        seen = [post.pk for page in paginator.iter_pages() for post in page]
+        self.assertEqual(seen, [post.pk for post in reversed(posts)])
+        self.assertEqual(paginator.count, 5)
+
+        second = paginator.get_page(paginator.get_page(None).next_cursor)
+        previous = paginator.get_page(second.previous_cursor)
+        self.assertEqual([post.pk for post in previous], seen[:2])
+
+    def test_query_is_sanitized(self):
+        Post.objects.create(text='AND OR NOT', author=self.author)
+        self.assertEqual(self.found('"NOT (" *'), self.found('not'))
+        self.assertEqual(self.found('   '), [])
+
+    def test_search_views(self):
+        post = Post.objects.create(text='Поиск работает', author=self.author)
+        response = self.client.get(reverse('search'), {'q': 'работает'})
+        self.assertEqual(list(response.context['page']), [post])
+        api = APIClient()
+        api.force_authenticate(self.author)
+        response = api.get('/api/v1/search/', {'q': 'работает'})
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']], [post.pk])
+
+
+class AsgiTest(TransactionTestCase):
+    # WSGI-приложение работает в потоках пула, им нужны
+    # закоммиченные данные, поэтому без транзакции теста
+    def setUp(self):
+        from yatube.asgi import application
+        self.application = application
+        self.user = User.objects.create_user(username="asgi")
+        Post.objects.create(text='Пост через ASGI', author=self.user)
+
+    def call(self, path, query_string=b'', headers=()):
+        scope = {'type': 'http', 'method': 'GET', 'path': path,
+                 'query_string': query_string, 'http_version': '1.1',
+                 'headers': list(headers)}
+        messages = [{'type': 'http.request', 'body': b''}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.application(scope, receive, send))
+        return sent
+
+    def test_page(self):
+        sent = self.call('/')
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn('Пост через ASGI', sent[1]['body'].decode())
+        self.assertEqual(len(sent), 2)
+
+    def test_streaming_response(self):
+        token = Token.objects.create(user=self.user)
+        sent = self.call('/api/v1/posts/', b'stream=1', [
+            (b'authorization', ('Token %s' % token.key).encode())])
+        self.assertEqual(sent[0]['status'], 200)
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        self.assertEqual(
+            json.loads(body.decode().splitlines()[0])['text'],
+            'Пост через ASGI')
+        self.assertFalse(sent[-1].get('more_body'))
+
+    def test_profile_follow_state_in_one_query(self):
+        author = User.objects.create_user(username="followed")
+        Follow.objects.create(user=self.user, author=author)
+        client = Client()
+        client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('profile', args=[author]))
+        self.assertTrue(response.context['following'])
+        self.assertFalse([q for q in queries if 'posts_follow' in q['sql']
+                          and 'auth_user' not in q['sql']])
+
+
+@override_settings(LIVE_HEARTBEAT=0.01, LIVE_STREAM_SECONDS=0.05,
+                   LIVE_POLL_SECONDS=0.01)
+class LiveFeedTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="live")
+        self.author = User.objects.create_user(username="live_author")
+        self.start = live.broker.last_id
+
+    def publish(self, **kwargs):
+        with mock.patch('posts.signals.transaction.on_commit',
+                        lambda callback: callback()):
+            return Post.objects.create(**kwargs)
+
+    def test_signal_publishes_rendered_post(self):
+        post = self.publish(text='Свежий пост', author=self.author)
+        post.text = 'Правка'
+        post.save()
+        events = live.broker.since(self.start)
+        self.assertEqual([data['post'] for _, data in events], [post.pk])
+        self.assertIn('Свежий пост', events[0][1]['html'])
+
+    def test_sse_stream(self):
+        post = self.publish(text='Свежий пост', author=self.author)
+        response = self.client.get(
+            reverse('live_posts'), HTTP_LAST_EVENT_ID=str(self.start))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertTrue(body.startswith('retry: 3000\n\n'))
+        event = body.split('\n\n')[1].split('\n')
+        self.assertEqual(event[:2], ['id: %d' % live.broker.last_id,
+                                     'event: post'])
+        self.assertEqual(json.loads(event[2][len('data: '):])['post'], post.pk)
+        self.assertIn(': ping', body)
+
+    def test_long_poll_follow_filter(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        self.client.force_login(self.user)
+        followed = self.publish(text='Подписка', author=self.author)
+        self.publish(text='Чужой', author=self.user)
+        response = self.client.get(reverse('live_posts'), {
+            'poll': 1, 'follow': 1, 'last_id': self.start}).json()
+        self.assertEqual(response['last_id'], live.broker.last_id)
+        self.assertEqual(
+            [event['post'] for event in response['events']], [followed.pk])
+
+        response = self.client.get(
+            reverse('live_posts'), {'poll': 1}).json()
+        self.assertEqual(response['events'], [])
+
+    def test_streams_are_capped(self):
+        post = self.publish(text='Свежий пост', author=self.author)
+        with self.settings(LIVE_MAX_STREAMS=1):
+            first = self.client.get(
+                reverse('live_posts'), HTTP_LAST_EVENT_ID=str(self.start))
+            second = self.client.get(reverse('live_posts'))
+            self.assertEqual(second.status_code, 503)
+            self.assertIn('Retry-After', second)
+            # long-poll сверх лимита отвечает сразу, без ожидания
+            with mock.patch.object(live.broker, 'wait') as wait:
+                response = self.client.get(reverse('live_posts'), {
+                    'poll': 1, 'last_id': self.start}).json()
+            wait.assert_not_called()
+            self.assertEqual(
+                [event['post'] for event in response['events']], [post.pk])
+            b''.join(first.streaming_content)
+            self.assertEqual(
+                self.client.get(reverse('live_posts')).status_code, 200)
+
+    def test_live_feed_is_opt_in(self):
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'id="live-toggle"')
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="etag")
+        self.group = Group.objects.create(title='ETag', slug='etag')
+        self.post = Post.objects.create(
+            text='text', author=self.user, group=self.group)
+
+    def revalidate(self, url, client=None):
+        client = client or self.client
+        with CaptureQueriesContext(connection) as full:
+            response = client.get(url)
+        self.assertLess(response.status_code, 300)
+        self.assertIn('Last-Modified', response)
+        with CaptureQueriesContext(connection) as queries:
+            cached = client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertFalse(cached.templates)
+        self.assertLess(len(queries), len(full))
+        return response['ETag']
+
+    def test_pages_answer_not_modified(self):
+        for url in (reverse('profile', args=[self.user]),
+                    reverse('post_view', args=[self.user, self.post.pk]),
+                    reverse('group_posts', args=[self.group.slug])):
+            etag = self.revalidate(url)
+            start = len(connection.run_on_commit)
+            Comment.objects.create(post=self.post, author=self.user, text='c')
+            # каждый комментарий — отдельный запрос со своим коммитом
+            run_commit_callbacks(start)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_user_and_follow(self):
+        url = reverse('profile', args=[self.user])
+        etag = self.revalidate(url)
+        reader = User.objects.create_user(username="reader")
+        self.client.force_login(reader)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.revalidate(url)
+        Follow.objects.create(user=reader, author=self.user)
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_api_answer_not_modified(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.revalidate('/api/v1/posts/%d/' % self.post.pk, client)
+        etag = self.revalidate('/api/v1/posts/', client)
+        Post.objects.create(text='new', author=self.user)
+        self.assertEqual(client.get(
+            '/api/v1/posts/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_missing_objects_still_404(self):
+        self.assertEqual(
+            self.client.get(reverse('profile', args=['nobody'])).status_code,
+            404)
+
+
+class BulkAPITest(TestCase):
+    url = '/api/v1/posts/bulk/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="importer")
+        self.follower = User.objects.create_user(username="reader")
+        Follow.objects.create(user=self.follower, author=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_create_json_array(self):
+        items = [{'text': 'импорт %d' % i} for i in range(30)]
+        items.insert(3, {'text': ''})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, items, format='json')
+        self.assertLess(len(queries), 30)
+        data = response.json()
+        self.assertEqual((data['ok'], data['errors']), (30, 1))
+        self.assertEqual(data['results'][3]['status'], 'error')
+        self.assertIn('text', data['results'][3]['errors'])
+        created = [item['id'] for item in data['results']
+                   if item['status'] == 'created']
+        self.assertEqual(
+            list(Post.objects.filter(pk__in=created).order_by('pk')
+                 .values_list('text', flat=True)),
+            ['импорт %d' % i for i in range(30)])
+        self.assertEqual(AuthorStats.objects.get(user=self.user).posts_count, 30)
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.follower).count(), 30)
+        self.assertEqual(
+            [post.pk for post in search.paginator('импорт', 50).get_page(None)
+             if post.text == 'импорт 7'], [created[7]])
+
+    def test_bulk_update_ndjson_and_delete(self):
+        own = Post.objects.create(text='old', author=self.user)
+        alien = Post.objects.create(text='alien', author=self.follower)
+        body = '\n'.join(json.dumps(item) for item in [
+            {'id': own.pk, 'text': 'new'},
+            {'id': alien.pk, 'text': 'hacked'},
+            {'text': 'created'},
+        ]) + '\n'
+        response = self.client.post(
+            self.url, body, content_type='application/x-ndjson')
+        statuses = [item['status'] for item in response.json()['results']]
+        self.assertEqual(statuses, ['updated', 'error', 'created'])
+        own.refresh_from_db()
+        alien.refresh_from_db()
+        self.assertEqual((own.text, alien.text), ('new', 'alien'))
+
+        response = self.client.delete(
+            self.url, [own.pk, alien.pk], format='json')
+        statuses = [item['status'] for item in response.json()['results']]
+        self.assertEqual(statuses, ['deleted', 'error'])
+        self.assertFalse(Post.objects.filter(pk=own.pk).exists())
+        self.assertEqual(AuthorStats.objects.get(user=self.user).posts_count, 1)
+
+    def test_bad_body(self):
+        response = self.client.post(self.url, {'text': 'x'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            self.url, '{"text": "x"}\nnot json\n',
+            content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+
+
+class SparseFieldsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="sparse", first_name="Анна")
+        self.group = Group.objects.create(title='Группа', slug='sparse')
+        self.post = Post.objects.create(
+            text='text', author=self.user, group=self.group)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        sql = [q['sql'] for q in queries if 'posts_post' in q['sql']]
+        return response, sql
+
+    def test_default_output_unchanged(self):
+        response, sql = self.get('/api/v1/posts/%d/' % self.post.pk)
+        self.assertEqual(set(response.json()), {
+            'id', 'text', 'author', 'image', 'pub_date', 'image_variants'})
+        self.assertEqual(response.json()['author'], self.user.pk)
+        self.assertNotIn('JOIN', sql[0])
+
+    def test_fields_select_only_needed_columns(self):
+        response, sql = self.get('/api/v1/posts/', fields='id')
+        self.assertEqual(response.json()['results'], [{'id': self.post.pk}])
+        self.assertNotIn('"text"', sql[0])
+        self.assertFalse([q for q in sql if 'posts_postimagevariant' in q])
+
+    def test_expand_relations(self):
+        response, sql = self.get(
+            '/api/v1/posts/', fields='id,text',
+            expand='author,group,comments_count')
+        item = response.json()['results'][0]
+        self.assertEqual(item['author'], {
+            'id': self.user.pk, 'username': 'sparse', 'first_name': 'Анна',
+            'last_name': ''})
+        self.assertEqual(item['group']['slug'], 'sparse')
+        self.assertEqual(item['comments_count'], 0)
+        self.assertEqual(len(sql), 1)
+        self.assertNotIn('"password"', sql[0])
+
+    def test_unknown_field(self):
+        response, sql = self.get('/api/v1/posts/', fields='secret')
+        self.assertEqual(response.status_code, 400)
+
+
+class FastJSONTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username="fast", first_name="Фёдор")
+        group = Group.objects.create(title='Группа "1"', slug='fast')
+        self.post = Post.objects.create(
+            text='Юникод и "кавычки"\n</script>', author=self.user,
+            group=group, image='posts/picture.png')
+        PostImageVariant.objects.create(
+            post=self.post, width=320, height=113, format='webp',
+            file='posts/variants/picture-320.webp')
+        Comment.objects.create(post=self.post, author=self.user, text='c')
+        Post.objects.create(text='без группы', author=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertSameBytes(self, url):
+        fast = self.client.get(url)
+        # indent=0 рендерится компактно, но уводит на путь сериализатора
+        slow = self.client.get(url, HTTP_ACCEPT='application/json; indent=0')
+        self.assertEqual(fast.status_code, slow.status_code)
+        self.assertNotIsInstance(fast, Response)
+        self.assertIsInstance(slow, Response)
+        self.assertEqual(fast.content, slow.content)
+
+    def test_byte_compatible(self):
+        for query in ('', '?page_size=1', '?fields=id,image',
+                      '?expand=author,group,comments_count',
+                      '?fields=text&expand=group'):
+            self.assertSameBytes('/api/v1/posts/' + query)
+            self.assertSameBytes('/api/v1/posts/%d/' % self.post.pk + query)
+
+    def test_stdlib_encoder_fallback(self):
+        with mock.patch.object(fastjson, 'orjson', None):
+            self.assertSameBytes('/api/v1/posts/?expand=author')
+
+    def test_cursor_pages(self):
+        first = self.client.get('/api/v1/posts/?page_size=1').json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual([item['text'] for item in second['results']],
+                         [self.post.text])
+
+    def test_missing_post(self):
+        self.assertEqual(
+            self.client.get('/api/v1/posts/100500/').status_code, 404)
+
+
+@override_settings(RATE_LIMITS={
+    'follow': '2/m', 'api': '3/m', 'api_token': '3/m'})
+class RateLimitTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username="limited")
+        self.author = User.objects.create_user(username="writer")
+        self.client.force_login(self.user)
+
+    def follow(self, client=None):
+        return (client or self.client).get(
+            reverse('profile_follow', args=[self.author.username]))
+
+    def test_view_limit(self):
+        self.assertEqual(self.follow().status_code, 302)
+        self.assertEqual(self.follow().status_code, 302)
+        response = self.follow()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        # корзина своя у каждого пользователя
+        other = Client()
+        other.force_login(self.author)
+        self.assertEqual(self.follow(other).status_code, 302)
+
+    def test_tokens_refill(self):
+        with mock.patch('posts.ratelimit.time.time', return_value=1000.0):
+            self.follow()
+            self.follow()
+            self.assertEqual(self.follow().status_code, 429)
+        with mock.patch('posts.ratelimit.time.time', return_value=1030.0):
+            self.assertEqual(self.follow().status_code, 302)
+            self.assertEqual(self.follow().status_code, 429)
+
+    def test_api_throttle_by_token(self):
+        token = Token.objects.create(user=self.user)
+        client = APIClient(HTTP_AUTHORIZATION='Token ' + token.key)
+        for _ in range(3):
+            self.assertEqual(client.get('/api/v1/posts/').status_code, 200)
+        response = client.get('/api/v1/posts/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
+
+    def test_anonymous_by_ip(self):
+        self.user.set_password('secret-pass')
+        self.user.save()
+        for address, expected in (('10.0.0.1', 200), ('10.0.0.1', 200),
+                                  ('10.0.0.1', 200), ('10.0.0.1', 429),
+                                  ('10.0.0.2', 200)):
+            response = Client().post(
+                '/api-token-auth/',
+                {'username': 'limited', 'password': 'secret-pass'},
+                REMOTE_ADDR=address)
+            self.assertEqual(response.status_code, expected)
+
+    def login(self, address, forwarded):
+        return Client().post(
+            '/api-token-auth/', {'username': 'limited', 'password': 'x'},
+            REMOTE_ADDR=address, HTTP_X_FORWARDED_FOR=forwarded).status_code
+
+    def test_forwarded_for_is_not_trusted(self):
+        statuses = [self.login('10.0.0.1', '192.0.2.%d' % i)
+                    for i in range(4)]
+        self.assertEqual(statuses, [400, 400, 400, 429])
+
+    def test_forwarded_for_behind_proxy(self):
+        with self.settings(REST_FRAMEWORK=dict(
+                settings.REST_FRAMEWORK, NUM_PROXIES=1)):
+            statuses = [self.login('10.0.0.1', '192.0.2.%d' % (i // 3))
+                        for i in range(4)]
+        self.assertEqual(statuses, [400] * 4)
+
+    def test_no_database_writes(self):
+        self.follow()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(ratelimit.check('follow', mock.Mock(
+                user=self.user, auth=None)), 0)
+        self.assertEqual(len(queries), 0)
+
+
+class TokenCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username="tokened")
+        self.token = Token.objects.create(user=self.user)
+
+    def get(self, key=None):
+        return APIClient().get(
+            '/api/v1/posts/',
+            HTTP_AUTHORIZATION='Token ' + (key or self.token.key))
+
+    def test_cached_lookup_saves_query(self):
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.get().status_code, 200)
+        with CaptureQueriesContext(connection) as second:
+            response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(second), len(first) - 1)
+        self.assertFalse(any('authtoken_token' in query['sql']
+                             for query in second.captured_queries))
+
+    def test_deleted_token(self):
+        key = self.token.key
+        self.get()
+        self.token.delete()
+        self.assertEqual(self.get(key).status_code, 401)
+
+    def test_rotated_token(self):
+        self.get()
+        old_key = self.token.key
+        self.token.delete()
+        new = Token.objects.create(user=self.user)
+        self.assertEqual(self.get(old_key).status_code, 401)
+        self.assertEqual(self.get(new.key).status_code, 200)
+
+    def test_deactivated_user(self):
+        self.get()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_unknown_token_is_not_cached(self):
+        self.assertEqual(self.get('0' * 40).status_code, 401)
+        self.assertEqual(self.get('0' * 40).status_code, 401)
+
+
+class DatabaseSettingsTest(TestCase):
+    def test_sqlite_pragmas(self):
+        path = os.path.join(tempfile.mkdtemp(), 'db.sqlite3')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        wrapper = type(connections['default'])(
+            dict(connection.settings_dict, NAME=path), alias='pragmas')
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            values = []
+            for name in ('journal_mode', 'synchronous', 'mmap_size'):
+                cursor.execute('PRAGMA %s' % name)
+                values.append(cursor.fetchone()[0])
+        self.assertEqual(values, ['wal', 1, 256 * 1024 * 1024])
+
+    def test_broken_persistent_connection_closed(self):
+        broken = mock.Mock(
+            connection=object(), settings_dict={'CONN_MAX_AGE': 60},
+            in_atomic_block=False, **{'is_usable.return_value': False})
+        healthy = mock.Mock(
+            connection=object(), settings_dict={'CONN_MAX_AGE': 60},
+            in_atomic_block=False, **{'is_usable.return_value': True})
+        with mock.patch.object(db.connections, 'all',
+                               return_value=[broken, healthy]):
+            db.check_connections(sender=None)
+        broken.close.assert_called_once_with()
+        healthy.close.assert_not_called()
+
+    def test_production_cache_is_shared(self):
+        with mock.patch.dict(os.environ, {
+                'DJANGO_SECRET_KEY': 'secret',
+                'MEMCACHED_LOCATION': 'cache1:11211,cache2:11211'}):
+            production = importlib.reload(
+                importlib.import_module('yatube.settings_production'))
+        cache_settings = production.CACHES['default']
+        self.assertEqual(cache_settings['BACKEND'],
+                         'yatube.metrics.InstrumentedMemcachedCache')
+        self.assertEqual(cache_settings['LOCATION'],
+                         ['cache1:11211', 'cache2:11211'])
+
+
+class ReplicaRouterTest(TransactionTestCase):
+    """Основная база — тестовая SQLite, реплика — отдельный файл SQLite,
+    куда изменения не реплицируются: так видно, откуда читает запрос."""
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        connections.databases['replica'] = dict(
+            connections['default'].settings_dict,
+            NAME=os.path.join(directory, 'replica.sqlite3'))
+        self.addCleanup(connections.databases.pop, 'replica')
+        self.addCleanup(connections.__delitem__, 'replica')
+        self.addCleanup(lambda: connections['replica'].close())
+        call_command('migrate', database='replica', verbosity=0)
+        replicas = override_settings(DATABASE_REPLICAS=['replica'])
+        replicas.enable()
+        self.addCleanup(replicas.disable)
+
+        self.reader = User.objects.create_user(username='reader')
+        # пользователь есть в обеих базах, автор — только на реплике
+        User.objects.db_manager('replica').bulk_create([
+            User(pk=self.reader.pk, username='reader',
+                 password=self.reader.password),
+            User(pk=self.reader.pk + 100, username='ghost')])
+        self.client.force_login(self.reader)
+
+    def test_reads_from_replica(self):
+        self.assertEqual(self.client.get('/ghost/').status_code, 200)
+        self.assertEqual(self.client.get('/reader/').status_code, 200)
+
+    def test_pinned_to_primary_after_write(self):
+        response = self.client.post(reverse('new_post'), {'text': 'Свой'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        self.assertEqual(self.client.get('/ghost/').status_code, 404)
+        self.assertContains(self.client.get('/reader/'), 'Свой')
+
+        del self.client.cookies[routers.PIN_COOKIE]
+        self.assertEqual(self.client.get('/ghost/').status_code, 200)
+
+    def test_fresh_generation_reads_primary(self):
+        # пост только в основной базе, поколения ленты и автора сдвинуты
+        Post.objects.create(text='Свежий', author=self.reader)
+        anonymous = Client()
+        self.assertContains(anonymous.get('/reader/'), 'Свежий')
+        self.assertContains(anonymous.get('/'), 'Свежий')
+        later = time.time_ns() + (settings.REPLICA_PIN_SECONDS + 1) * 10 ** 9
+        with mock.patch('posts.caching.time.time_ns', return_value=later):
+            # реплика догнала: снова читаем с неё, фрагмент уже в кэше
+            self.assertEqual(anonymous.get('/ghost/').status_code, 200)
+            self.assertContains(anonymous.get('/'), 'Свежий')
+
+    def test_primary_outside_requests(self):
+        self.assertFalse(User.objects.filter(username='ghost').exists())
+        self.assertEqual(
+            routers.ReplicaRouter().db_for_read(Post), 'default')
+
+
+class GroupDirectoryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        groups.clear()
+        self.group = Group.objects.create(title='Коты', slug='cats')
+        self.user = User.objects.create_user(username="grouper")
+        self.post = Post.objects.create(
+            text='Мяу', author=self.user, group=self.group)
+        self.client.force_login(self.user)
+        groups.directory()
+
+    def group_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries
+                          if 'posts_group' in query['sql']]
+
+    def test_lookups_without_queries(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(groups.by_slug('cats'), self.group)
+            self.assertEqual(groups.get(str(self.group.pk)), self.group)
+            self.assertIsNone(groups.by_slug('dogs'))
+            self.assertIsNone(groups.get('x'))
+
+    def test_pages_without_group_queries(self):
+        for url in (reverse('index'), reverse('group_posts', args=['cats']),
+                    reverse('new_post')):
+            response, queries = self.group_queries(url)
+            self.assertEqual(queries, [], url)
+        self.assertContains(response, 'Коты')
+        response, queries = self.group_queries(reverse('index'))
+        self.assertContains(response, '/group/cats/')
+
+    def test_shared_cache_for_other_processes(self):
+        groups.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(groups.by_slug('cats'), self.group)
+
+    def test_invalidated_by_signals(self):
+        self.group.slug = 'kittens'
+        self.group.save()
+        self.assertIsNone(groups.by_slug('cats'))
+        self.assertEqual(groups.by_slug('kittens').title, 'Коты')
+        self.assertEqual(self.client.get('/group/cats/').status_code, 404)
+        self.group.delete()
+        self.assertEqual(groups.all_groups(), [])
+
+    def test_form_validates_from_directory(self):
+        form = PostForm({'text': 'Гав', 'group': str(self.group.pk)})
+        with self.assertNumQueries(0):
+            self.assertEqual(form.fields['group'].clean(str(self.group.pk)),
+                             self.group)
+            self.assertIn('Коты', str(form['group']))
+        self.assertTrue(form.is_valid())
+        form = PostForm({'text': 'Гав', 'group': '100500'})
+        self.assertIn('group', form.errors)
+
+
+class CommentThreadTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="talker")
+        self.post = Post.objects.create(text='Обсуждаем', author=self.author)
+        self.client.force_login(self.author)
+        self.url = reverse('post_view', args=['talker', self.post.pk])
+
+    def comment(self, text, parent=None):
+        return Comment.objects.create(
+            post=self.post, author=self.author, text=text, parent=parent)
+
+    def test_materialized_path(self):
+        root = self.comment('корень')
+        reply = self.comment('ответ', parent=root)
+        self.assertEqual(root.path, '%010d' % root.pk)
+        self.assertEqual(reply.path, '%010d.%010d' % (root.pk, reply.pk))
+        low, high = Comment.thread_bounds(root.pk)
+        self.assertEqual(
+            list(Comment.objects.filter(path__gte=low, path__lt=high)
+                 .order_by('path')), [root, reply])
+
+    def test_reply_to_reply_joins_thread(self):
+        root = self.comment('корень')
+        reply = self.comment('ответ', parent=root)
+        add_url = reverse('add_comment', args=['talker', self.post.pk])
+        self.client.post(add_url, {'text': 'ещё', 'parent': reply.pk})
+        self.client.post(add_url, {'text': 'чужой', 'parent': 100500})
+        self.assertEqual(
+            Comment.objects.get(text='ещё').parent_id, root.pk)
+        self.assertIsNone(Comment.objects.get(text='чужой').parent_id)
+
+    def add_threads(self, count, start=0):
+        for i in range(start, start + count):
+            root = self.comment('корень %d' % i)
+            self.comment('ответ %d' % i, parent=root)
+
+    def test_post_page_is_paginated(self):
+        self.add_threads(3)
+        with CaptureQueriesContext(connection) as baseline:
+            self.client.get(self.url)
+        self.add_threads(22, start=3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(len(queries), len(baseline))
+        page = response.context['comments']
+        self.assertEqual(len(page), views.COMMENTS_PAGE_SIZE)
+        self.assertEqual([reply.text for reply in page[0].thread_replies],
+                         ['ответ 0'])
+        self.assertContains(response, 'ответ 19')
+        self.assertNotContains(response, 'корень 20')
+
+        response = self.client.get(self.url, {'cursor': page.next_cursor})
+        self.assertEqual(
+            [comment.text for comment in response.context['comments']],
+            ['корень %d' % i for i in range(20, 25)])
+
+    def test_reply_fields_have_unique_ids(self):
+        roots = [self.comment('корень %d' % i) for i in range(3)]
+        response = self.client.get(self.url)
+        self.assertContains(response, 'id="id_text"', count=1)
+        for root in roots:
+            self.assertContains(
+                response, 'id="id_text_%d"' % root.pk, count=1)
+
+    def test_api_endpoint(self):
+        self.add_threads(3)
+        client = APIClient()
+        client.force_authenticate(self.author)
+        url = '/api/v1/posts/%d/comments/' % self.post.pk
+        with self.assertNumQueries(3):
+            data = client.get(url, {'page_size': 2}).json()
+        self.assertEqual([item['text'] for item in data['results']],
+                         ['корень 0', 'корень 1'])
+        self.assertEqual(data['results'][0]['author'], 'talker')
+        self.assertEqual(
+            [reply['text'] for reply in data['results'][1]['replies']],
+            ['ответ 1'])
+        data = client.get(data['next']).json()
+        self.assertEqual([item['text'] for item in data['results']],
+                         ['корень 2'])
+        self.assertEqual(client.get(
+            '/api/v1/posts/100500/comments/').status_code, 404)
+
+    def test_replies_query_is_limited_to_post(self):
+        other = Post.objects.create(text='Другой', author=self.author)
+        root = self.comment('корень')
+        foreign = Comment.objects.create(
+            post=other, author=self.author, text='чужой корень')
+        Comment.objects.create(
+            post=other, author=self.author, text='чужой ответ',
+            parent=foreign)
+        self.comment('ответ', parent=root)
+        self.comment('последний корень')
+        paginator = comments.CommentPaginator(self.post.pk, 10)
+        with CaptureQueriesContext(connection) as queries:
+            page = list(paginator.get_page(None))
+        self.assertEqual([[reply.text for reply in comment.thread_replies]
+                          for comment in page], [['ответ'], []])
+        self.assertIn('"posts_comment"."post_id" = %d' % self.post.pk,
+                      queries[-1]['sql'])
+
+    def test_fill_paths_after_bulk_create(self):
+        Comment.objects.bulk_create([Comment(
+            post=self.post, author=self.author, text='пачкой')])
+        comments.fill_paths()
+        comment = Comment.objects.get(text='пачкой')
+        self.assertEqual(comment.path, Comment.make_path(comment.pk))
+
+
+@override_settings(JOB_RETRY_BASE_SECONDS=10, JOB_RETRY_MAX_SECONDS=15)
+class JobQueueTest(TestCase):
+    def setUp(self):
+        self.calls = []
+        tasks = mock.patch.dict(jobs.TASKS, {
+            'test.record': lambda *args, **kwargs: self.calls.append(
+                (args, kwargs)),
+            'test.fail': self.fail_task,
+        })
+        tasks.start()
+        self.addCleanup(tasks.stop)
+
+    def fail_task(self):
+        raise ValueError('сломалось')
+
+    def test_run_job(self):
+        job = jobs.enqueue('test.record', 1, 'два', flag=True)
+        self.assertTrue(jobs.run_next('w1'))
+        self.assertFalse(jobs.run_next('w1'))
+        self.assertEqual(self.calls, [((1, 'два'), {'flag': True})])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 1))
+        self.assertIsNotNone(job.finished)
+        with self.assertRaises(ValueError):
+            jobs.enqueue('test.unknown')
+
+    def test_delayed_job_waits(self):
+        jobs.enqueue('test.record', delay=60)
+        self.assertEqual(jobs.claim('w1'), [])
+
+    def test_retry_with_backoff_then_fail(self):
+        job = jobs.enqueue('test.fail', max_attempts=3)
+        delays = []
+        for attempt in range(3):
+            before = timezone.now()
+            self.assertTrue(jobs.run_next('w1'))
+            job.refresh_from_db()
+            if job.status == Job.QUEUED:
+                delays.append(round((job.run_at - before).total_seconds()))
+                # не ждём задержку
+                Job.objects.filter(pk=job.pk).update(run_at=before)
+        self.assertEqual(delays, [10, 15])
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 3))
+        self.assertIn('сломалось', job.last_error)
+        self.assertFalse(jobs.run_next('w1'))
+
+        jobs.retry(Job.objects.all())
+        self.assertEqual(jobs.claim('w1')[0].attempts, 1)
+
+    def test_claim_is_exclusive(self):
+        jobs.enqueue('test.record')
+        jobs.enqueue('test.record', delay=60)
+        self.assertEqual(len(jobs.claim('w1', limit=2)), 1)
+        self.assertEqual(jobs.claim('w2'), [])
+
+    def test_expired_lease_is_reclaimed(self):
+        job = jobs.enqueue('test.record')
+        jobs.claim('w1')
+        Job.objects.filter(pk=job.pk).update(
+            locked_until=timezone.now() - timedelta(seconds=1))
+        claimed = jobs.claim('w2')
+        self.assertEqual([(j.pk, j.attempts) for j in claimed], [(job.pk, 2)])
+        # первый воркер очнулся: его отметка уже ничего не меняет
+        stale = Job.objects.get(pk=job.pk)
+        stale.locked_by = 'w1'
+        jobs.execute(stale)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.RUNNING)
+        jobs.execute(claimed[0])
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.DONE)
+
+    def test_run_worker_command(self):
+        for i in range(5):
+            jobs.enqueue('test.record', i)
+        jobs.enqueue('test.fail', max_attempts=1)
+        call_command('run_worker', burst=True, stdout=StringIO())
+        self.assertEqual(sorted(args[0] for args, _ in self.calls),
+                         list(range(5)))
+        self.assertEqual(
+            sorted(Job.objects.values_list('status', flat=True)),
+            [Job.DONE] * 5 + [Job.FAILED])
+
+    def test_admin_retry(self):
+        admin = User.objects.create_superuser(
+            username='boss', email='boss@example.com', password='secret')
+        self.client.force_login(admin)
+        job = jobs.enqueue('test.fail', max_attempts=1)
+        jobs.run_next('w1')
+        url = reverse('admin:posts_job_changelist')
+        self.assertContains(self.client.get(url), 'test.fail')
+        self.client.post(url, {
+            'action': 'retry', '_selected_action': [job.pk]})
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 0))
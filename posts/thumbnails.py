@@ -0,0 +1,168 @@
+"""Фоновая подготовка превью картинок постов.
+
+Шаблоны не генерируют превью сами: они берут готовое из key-value
+хранилища sorl-thumbnail, а если его ещё нет — показывают оригинал.
+Генерация запускается после сохранения поста в пуле потоков
+процесса или, при `THUMBNAIL_QUEUE = 'jobs'`, задачей очереди
+posts/jobs.py — тогда превью готовит `manage.py run_worker`.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from PIL import features
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import connection, transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+
+from . import caching, jobs
+from .models import Post, PostImageVariant
+
+logger = logging.getLogger(__name__)
+
+# Именованные размеры превью: имя -> (геометрия, опции sorl)
+SPECS = {
+    'card': ('960x339', {'crop': 'top', 'upscale': True}),
+}
+# Ширины копий для srcset; пропорции как у карточки 960x339
+VARIANT_WIDTHS = (320, 640, 960)
+CARD_RATIO = 339 / 960
+SIZES = '(max-width: 960px) 100vw, 960px'
+
+
+class PrecomputedThumbnailBackend(ThumbnailBackend):
+    def get_cached_thumbnail(self, file_, geometry_string, **options):
+        """Как `get_thumbnail`, но только читает хранилище и никогда
+        не генерирует превью. Возвращает None, если его ещё нет."""
+        source = ImageFile(file_)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return default.kvstore.get(ImageFile(name, default.storage))
+
+
+backend = PrecomputedThumbnailBackend()
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKERS,
+            thread_name_prefix='thumbnails')
+    return _executor
+
+
+def thumbnail_url(image, spec='card'):
+    """URL готового превью или оригинала, если превью ещё не готово."""
+    if not image:
+        return ''
+    geometry, options = SPECS[spec]
+    thumbnail = backend.get_cached_thumbnail(image, geometry, **options)
+    return thumbnail.url if thumbnail else image.url
+
+
+def generate(name):
+    for geometry, options in SPECS.values():
+        try:
+            backend.get_thumbnail(name, geometry, **options)
+        except Exception:
+            logger.exception('Не удалось подготовить превью %s', name)
+
+
+def variant_formats(name):
+    """PNG остаётся PNG (прозрачность), остальное — JPEG; плюс WebP,
+    если Pillow собран с его поддержкой."""
+    formats = ['PNG' if name.lower().endswith('.png') else 'JPEG']
+    if features.check('webp'):
+        formats.append('WEBP')
+    return formats
+
+
+def build_variants(post_id, name):
+    """Готовит копии картинки всех ширин и форматов для `srcset`."""
+    post = Post.objects.filter(pk=post_id, image=name).only(
+        'author_id', 'group_id').first()
+    if post is None:
+        # пост удалён или картинку уже заменили
+        return
+    variants = []
+    for image_format in variant_formats(name):
+        for width in VARIANT_WIDTHS:
+            height = round(width * CARD_RATIO)
+            thumbnail = backend.get_thumbnail(
+                name, '%dx%d' % (width, height), crop='top', upscale=True,
+                format=image_format)
+            if not thumbnail.exists():
+                return
+            variants.append(PostImageVariant(
+                post_id=post_id, width=width, height=height,
+                format=image_format, file=thumbnail.name))
+    with transaction.atomic():
+        PostImageVariant.objects.filter(post_id=post_id).delete()
+        PostImageVariant.objects.bulk_create(variants)
+    # закэшированные ленты ещё ссылаются на оригинал
+    caching.bump(*caching.post_scopes(post))
+
+
+@jobs.task('thumbnails.process')
+def process(post_id, name):
+    generate(name)
+    try:
+        build_variants(post_id, name)
+    except Exception:
+        logger.exception('Не удалось подготовить копии %s', name)
+
+
+def run_in_worker(post_id, name):
+    try:
+        process(post_id, name)
+    finally:
+        # у каждого потока пула своё соединение с базой
+        connection.close()
+
+
+def srcsets(post):
+    """`srcset` по форматам из (предзагруженных) копий картинки поста."""
+    result = {}
+    variants = sorted(post.image_variants.all(), key=lambda v: v.width)
+    for variant in variants:
+        result.setdefault(variant.format, []).append(
+            '%s %dw' % (variant.file.url, variant.width))
+    return {image_format: ', '.join(items)
+            for image_format, items in result.items()}
+
+
+def enqueue(post, created=False):
+    """Ставит подготовку превью в очередь после коммита транзакции."""
+    image = post.image
+    if not image:
+        if not created:
+            PostImageVariant.objects.filter(post_id=post.pk).delete()
+        return
+    try:
+        if not image.storage.exists(image.name):
+            return
+    except SuspiciousFileOperation:
+        # путь вне MEDIA_ROOT — генерировать не из чего
+        return
+    post_id, name = post.pk, image.name
+    if settings.THUMBNAIL_QUEUE == 'jobs':
+        # задача пишется в той же транзакции, что и пост
+        jobs.enqueue('thumbnails.process', post_id, name)
+    elif settings.THUMBNAIL_ASYNC:
+        transaction.on_commit(
+            lambda: get_executor().submit(run_in_worker, post_id, name))
+    else:
+        process(post_id, name)
@@ -0,0 +1,77 @@
+from collections import defaultdict
+
+from django.db.models import prefetch_related_objects
+
+from .models import Follow, Post, TimelineEntry
+from .pagination import CursorPaginator
+
+BATCH_SIZE = 500
+
+
+def fan_out_post(post):
+    """Добавляет новый пост в ленты всех подписчиков автора."""
+    followers = Follow.objects.filter(
+        author_id=post.author_id).values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+         for user_id in followers.iterator()),
+        batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def fan_out_posts(posts):
+    """То же для пачки постов: подписчики читаются одним запросом."""
+    posts_by_author = defaultdict(list)
+    for post in posts:
+        posts_by_author[post.author_id].append(post)
+    followers = Follow.objects.filter(
+        author_id__in=posts_by_author).values_list('author_id', 'user_id')
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+         for author_id, user_id in followers.iterator()
+         for post in posts_by_author[author_id]),
+        batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def add_author(user_id, author_id):
+    """Переносит в ленту подписчика все посты нового автора."""
+    posts = Post.objects.filter(author_id=author_id).order_by().values_list(
+        'pk', 'pub_date')
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+         for post_id, pub_date in posts.iterator()),
+        batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def remove_author(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id).delete()
+
+
+def rebuild(user_ids=None):
+    """Пересобирает ленты с нуля по таблице подписок."""
+    entries = TimelineEntry.objects.all()
+    follows = Follow.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user_id__in=user_ids)
+        follows = follows.filter(user_id__in=user_ids)
+    entries.delete()
+    for user_id, author_id in follows.values_list(
+            'user_id', 'author_id').iterator():
+        add_author(user_id, author_id)
+
+
+class TimelinePaginator(CursorPaginator):
+    def prepare_rows(self, rows):
+        posts = [entry.post for entry in rows]
+        prefetch_related_objects(posts, 'image_variants')
+        return posts
+
+
+def get_page(user, cursor, per_page):
+    """Страница ленты подписок: keyset по (pub_date, post_id) внутри
+    ленты пользователя, без JOIN с таблицей подписок."""
+    entries = TimelineEntry.objects.filter(user=user).select_related(
+        'post__author', 'post__group')
+    paginator = TimelinePaginator(
+        entries, per_page, ordering=('-pub_date', '-post_id'))
+    return paginator, paginator.get_page(cursor)
@@ -1,12 +1,20 @@
 from django.urls import path
 from rest_framework.authtoken import views as rest_views
 
-from . import views
+from . import ratelimit, views
 
 urlpatterns = [
-    path('api-token-auth/', rest_views.obtain_auth_token),
+    # перебор паролей: у этого представления DRF троттлинг отключён
+    path('api-token-auth/',
+         ratelimit.limit('api_token')(rest_views.obtain_auth_token)),
     path('api/v1/posts/<int:id>/', views.APIPostDetail.as_view()),
+    path('api/v1/posts/<int:id>/comments/', views.APIPostComments.as_view(),
+         name='api_post_comments'),
+    path('api/v1/posts/stream/', views.live_posts, name='live_posts'),
+    path('api/v1/posts/bulk/', views.APIPostBulk.as_view()),
     path('api/v1/posts/', views.APIPost.as_view()),
+    path('api/v1/search/', views.APISearch.as_view()),
+    path("search/", views.search_posts, name="search"),
     path("follow/", views.follow_index, name="follow_index"),
     path("<str:username>/follow/", views.profile_follow, name="profile_follow"),
     path("<str:username>/unfollow/",
@@ -1,10 +1,18 @@
-from django.core.paginator import Paginator
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from .models import Post, Group, User, Comment, Follow
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils.decorators import method_decorator
+from .models import Post, User, Comment, Follow
 from .forms import PostForm, CommentForm
-from .serializers import PostSerializer
-from django.http import JsonResponse
+from .serializers import CommentSerializer, PostSerializer
+from .pagination import CursorPaginator, PostCursorPagination
+from .parsers import NDJSONParser
+from . import (
+    bulk, caching, comments, fastjson, groups, live, ratelimit, search,
+    timeline)
+from django.http import (
+    Http404, HttpResponse, JsonResponse, StreamingHttpResponse)
 from rest_framework.parsers import JSONParser
 from rest_framework.exceptions import ValidationError
 from rest_framework.decorators import api_view
@@ -12,6 +20,9 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
 
+STREAM_CHUNK_SIZE = 500
+COMMENTS_PAGE_SIZE = 20
+
 
 def page_not_found(request, exception):
     return render(
@@ -26,24 +37,59 @@ def server_error(request):
     return render(request, "misc/500.html", status=500)
 
 
+def author_scopes(request, username, **kwargs):
+    author_id = User.objects.filter(
+        username=username).values_list('pk', flat=True).first()
+    return None if author_id is None else [caching.author_scope(author_id)]
+
+
+def group_scopes(request, slug):
+    group = groups.by_slug(slug)
+    return None if group is None else [caching.group_scope(group.pk)]
+
+
+def post_scopes(request, id):
+    author_id = Post.objects.filter(
+        pk=id).values_list('author_id', flat=True).first()
+    return None if author_id is None else [caching.author_scope(author_id)]
+
+
+def feed_scopes(request):
+    if request.GET.get('stream'):
+        return None
+    return [caching.POSTS]
+
+
 def index(request):
-    post_list = Post.objects.order_by('-pub_date').all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, 'index.html', {'page': page, 'paginator': paginator})
+    post_list = Post.objects.feed()
+    # ключ раньше страницы: он решает, читать ли с реплики
+    cache_key = caching.fragment_key(request, caching.POSTS)
+    paginator = CursorPaginator(post_list, 10)
+    page = paginator.get_page(request.GET.get('cursor'))
+    return render(request, 'index.html', {'page': page, 'paginator': paginator, 'cache_key': cache_key})
 
 
+@caching.conditional(group_scopes)
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, "group.html", {"group": group, "page": page, "paginator": paginator})
+    group = groups.by_slug(slug)
+    if group is None:
+        raise Http404
+    posts = Post.objects.feed().filter(group_id=group.pk)
+    cache_key = caching.fragment_key(request, caching.group_scope(group.pk))
+    paginator = CursorPaginator(posts, 10)
+    page = paginator.get_page(request.GET.get('cursor'))
+    return render(request, "group.html", {"group": group, "page": page, "paginator": paginator, "cache_key": cache_key})
+
+
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    paginator = search.paginator(query, 10)
+    page = paginator.get_page(request.GET.get('cursor'))
+    return render(request, 'search.html', {'query': query, 'page': page, 'paginator': paginator})
 
 
 @login_required
+@ratelimit.limit('new_post', methods=('POST',))
 def new_post(request):
     if request.method == 'POST':
         form = PostForm(request.POST, files=request.FILES or None)
@@ -69,29 +115,39 @@ def post_edit(request, username, post_id):
     return render(request, 'new_post.html', {'edit': True, 'form': form, 'post': post})
 
 
+@caching.conditional(author_scopes)
 def profile(request, username):
-    user = get_object_or_404(User, username=username)
-    posts = user.posts.all()
-    following = request.user.is_authenticated and Follow.objects.filter(
-        user=request.user, author=user).exists()
+    users = User.objects.select_related('stats')
+    if request.user.is_authenticated:
+        # признак подписки приходит тем же запросом, что и автор
+        users = users.annotate(is_followed=Exists(Follow.objects.filter(
+            user=request.user, author=OuterRef('pk'))))
+    user = get_object_or_404(users, username=username)
+    posts = Post.objects.feed().filter(author=user)
+    following = getattr(user, 'is_followed', False)
 
-    paginator = Paginator(posts, 5)
+    cache_key = caching.fragment_key(request, caching.author_scope(user.pk))
+    paginator = CursorPaginator(posts, 5)
 
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    page = paginator.get_page(request.GET.get('cursor'))
 
-    return render(request, 'profile.html', {'page': page, 'paginator': paginator, 'author': user, 'following': following})
+    return render(request, 'profile.html', {'page': page, 'paginator': paginator, 'author': user, 'following': following, 'cache_key': cache_key})
 
 
+@caching.conditional(author_scopes)
 def post_view(request, username, post_id):
-    user = get_object_or_404(User, username=username)
-    count = user.posts.all().count
-    post = get_object_or_404(Post, pk=post_id, author__username=username)
+    user = get_object_or_404(
+        User.objects.select_related('stats'), username=username)
+    post = get_object_or_404(
+        Post.objects.feed(), pk=post_id, author__username=username)
     form = CommentForm()
-    return render(request, 'post.html', {'author': user, 'post': post, 'count': count, 'form': form})
+    paginator = comments.CommentPaginator(post.pk, COMMENTS_PAGE_SIZE)
+    page = paginator.get_page(request.GET.get('cursor'))
+    return render(request, 'post.html', {'author': user, 'post': post, 'form': form, 'comments': page})
 
 
 @login_required
+@ratelimit.limit('add_comment')
 def add_comment(request, username, post_id):
     post = get_object_or_404(Post, pk=post_id, author__username=username)
     form = CommentForm(request.POST or None)
@@ -99,6 +155,8 @@ def add_comment(request, username, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
+        comment.parent_id = comments.reply_parent(
+            post, request.POST.get('parent'))
         form.save()
         return redirect('post_view', username=username, post_id=post_id)
     return redirect('post_view', username=username, post_id=post_id)
@@ -107,17 +165,13 @@ def add_comment(request, username, post_id):
 @login_required
 def follow_index(request):
 
-    posts = Post.objects.select_related('author').filter(
-        author__following__user=request.user)
-
-    paginator = Paginator(posts, 10)
-
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    paginator, page = timeline.get_page(
+        request.user, request.GET.get('cursor'), 10)
     return render(request, 'follow.html', {'page': page, 'paginator': paginator})
 
 
 @login_required
+@ratelimit.limit('follow')
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     is_exist = Follow.objects.filter(user=request.user, author=author).exists()
@@ -128,6 +182,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@ratelimit.limit('follow')
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     follow_obj = Follow.objects.filter(user=request.user, author=author)
@@ -139,9 +194,15 @@ def profile_unfollow(request, username):
 @api_view(['POST', 'GET'])
 def get_posts(request):
     if request.method == 'GET':
-        posts = Post.objects.all()
+        paginator = PostCursorPagination()
+        if fastjson.accepts(request):
+            rows = paginator.paginate_queryset(
+                fastjson.values(Post.objects.all()), request)
+            return fastjson.json_response(
+                paginator.get_paginated_data(fastjson.items(rows)))
+        posts = paginator.paginate_queryset(Post.objects.feed(), request)
         serializer = PostSerializer(posts, many=True)
-        return JsonResponse(serializer.data, safe=False)
+        return paginator.get_paginated_response(serializer.data)
     elif request.method == 'POST':
         user = get_object_or_404(User, username=request.user)
         data = request.data.copy()
@@ -173,9 +234,20 @@ def api_posts_detail(request, id):
 
 
 class APIPostDetail(APIView):
+    @method_decorator(caching.conditional(post_scopes))
     def get(self, request, id):
-        post = get_object_or_404(Post, pk=id)
-        serializer = PostSerializer(post)
+        fields, expand = PostSerializer.parse_params(request.query_params)
+        posts = PostSerializer.prepare_queryset(
+            Post.objects.all(), fields, expand).filter(pk=id)
+        if fastjson.accepts(request):
+            rows = list(fastjson.values(posts, fields, expand))
+            if not rows:
+                raise Http404
+            return fastjson.json_response(
+                fastjson.items(rows, fields, expand)[0],
+                status=status.HTTP_201_CREATED)
+        post = get_object_or_404(posts)
+        serializer = PostSerializer(post, fields=fields, expand=expand)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def put(self, request, id):
@@ -206,11 +278,71 @@ class APIPostDetail(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+@ratelimit.limit('live_posts')
+def live_posts(request):
+    """Новые посты: SSE-поток или, с `?poll=1`, long-poll в JSON."""
+    last_id = live.last_event_id(request)
+    accept = live.event_filter(request)
+    if request.GET.get('poll'):
+        if live.acquire_stream():
+            try:
+                events = live.broker.wait(
+                    last_id, settings.LIVE_POLL_SECONDS)
+            finally:
+                live.release_stream()
+        else:
+            events = live.broker.since(last_id)
+        return JsonResponse({
+            'last_id': events[-1][0] if events else last_id,
+            'events': [dict(data, id=event_id) for event_id, data in events
+                       if accept(data)],
+        })
+    if not live.acquire_stream():
+        response = HttpResponse(
+            'Слишком много открытых потоков, попробуйте позже.',
+            status=503, content_type='text/plain; charset=utf-8')
+        response['Retry-After'] = str(settings.LIVE_HEARTBEAT)
+        return response
+    response = StreamingHttpResponse(
+        live.Stream(live.sse_events(last_id, accept)),
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def stream_posts(queryset, fields=None, expand=None):
+    """NDJSON-выгрузка: по объекту на строку, выборка кусками
+    по STREAM_CHUNK_SIZE через курсорную пагинацию."""
+    def lines():
+        rows = fastjson.values(queryset, fields, expand)
+        pages = CursorPaginator(rows, STREAM_CHUNK_SIZE).iter_pages()
+        for page in pages:
+            for item in fastjson.items(page.object_list, fields, expand):
+                yield fastjson.dumps(item) + b'\n'
+    return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+
 class APIPost(APIView):
+    pagination_class = PostCursorPagination
+
+    @method_decorator(caching.conditional(feed_scopes))
     def get(self, request):
-        posts = Post.objects.all()
-        serializer = PostSerializer(posts, many=True)
-        return Response(serializer.data)
+        fields, expand = PostSerializer.parse_params(request.query_params)
+        posts = PostSerializer.prepare_queryset(
+            Post.objects.all(), fields, expand)
+        if request.query_params.get('stream'):
+            return stream_posts(posts, fields, expand)
+        paginator = self.pagination_class()
+        if fastjson.accepts(request):
+            page = paginator.paginate_queryset(
+                fastjson.values(posts, fields, expand), request, view=self)
+            return fastjson.json_response(paginator.get_paginated_data(
+                fastjson.items(page, fields, expand)))
+        page = paginator.paginate_queryset(posts, request, view=self)
+        serializer = PostSerializer(
+            page, many=True, fields=fields, expand=expand)
+        return paginator.get_paginated_response(serializer.data)
 
     def post(self, request):
         user = get_object_or_404(User, username=request.user)
@@ -221,3 +353,60 @@ class APIPost(APIView):
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class APIPostComments(APIView):
+    """Комментарии поста ветками для бесконечной прокрутки."""
+    pagination_class = PostCursorPagination
+
+    def get(self, request, id):
+        post = get_object_or_404(Post.objects.only('pk'), pk=id)
+        paginator = self.pagination_class()
+        page = paginator.paginate(comments.CommentPaginator(
+            post.pk, paginator.get_page_size(request)), request)
+        serializer = CommentSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class APISearch(APIView):
+    pagination_class = PostCursorPagination
+
+    def get(self, request):
+        paginator = self.pagination_class()
+        page = paginator.paginate(search.paginator(
+            request.query_params.get('q', ''),
+            paginator.get_page_size(request)), request)
+        serializer = PostSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class APIPostBulk(APIView):
+    """Пакетная загрузка: JSON-массив или NDJSON. POST создаёт посты
+    без `id` и правит посты с `id`, DELETE удаляет посты по списку id."""
+    parser_classes = (JSONParser, NDJSONParser)
+    throttle_scope = 'api_bulk'
+
+    def post(self, request):
+        items = self.get_items(request)
+        results = bulk.save(request.user, items)
+        return self.respond(results)
+
+    def delete(self, request):
+        results = bulk.delete(request.user, self.get_items(request))
+        return self.respond(results)
+
+    @staticmethod
+    def get_items(request):
+        if not isinstance(request.data, list):
+            raise ValidationError('Expected a list of items.')
+        return request.data
+
+    @staticmethod
+    def respond(results):
+        errors = sum(1 for result in results if result['status'] == 'error')
+        return Response({
+            'ok': len(results) - errors,
+            'errors': errors,
+            'results': results,
+        }, status=status.HTTP_200_OK if errors < len(results) or not results
+            else status.HTTP_400_BAD_REQUEST)
@@ -1,4 +1,14 @@
+import pytest
+
 pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
+    'tests.fixtures.fixture_benchmark',
 ]
+
+
+@pytest.fixture(autouse=True)
+def sync_thumbnails(settings):
+    # превью готовятся в фоновом потоке (posts/thumbnails.py); такой
+    # поток держит базу и мешает её очистке после transaction=True тестов
+    settings.THUMBNAIL_ASYNC = False
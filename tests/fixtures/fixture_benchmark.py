@@ -0,0 +1,28 @@
+import random
+
+import pytest
+
+
+@pytest.fixture
+def bench_data(db, settings):
+    """Небольшой синтетический набор данных для бенчмарков. Лимиты
+    частоты отключены: иначе вместо задержек меряются ответы 429."""
+    from posts import benchmark
+    settings.RATE_LIMITS = {}
+    return benchmark.seed(
+        users=10, groups=2, posts=100, follows=20, comments=100,
+        rng=random.Random(0))
+
+
+@pytest.fixture
+def bench(bench_data):
+    """Прогоняет смесь запросов и возвращает отчёт `benchmark.report`:
+    `bench(50)`, `bench(50, mix={'index': 1})` или `bench(requests=[...])`."""
+    from posts import benchmark
+
+    def run(count=50, mix=None, requests=None, warmup=5):
+        if requests is None:
+            requests = benchmark.build_mix(count, mix, random.Random(0))
+        return benchmark.report(
+            benchmark.replay(requests, warmup), bench_data)
+    return run
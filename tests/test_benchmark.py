@@ -0,0 +1,38 @@
+import pytest
+
+
+class TestBenchmark:
+
+    @pytest.mark.django_db
+    def test_benchmark_mix(self, bench):
+        result = bench(60)
+        assert result['total']['requests'] == 60
+        assert result['total']['errors'] == 0, \
+            'Все запросы смеси должны отвечать без ошибок'
+        assert set(result['views']) <= {
+            'index', 'group_posts', 'profile', 'post_view', 'follow_index',
+            'api_posts', 'api_post_detail'}
+        for stats in result['views'].values():
+            assert stats['p50_ms'] <= stats['p95_ms'] <= stats['p99_ms']
+        assert result['max_rss_kb'] > 0
+
+    @pytest.mark.django_db
+    def test_benchmark_replay(self, bench, tmp_path):
+        from posts import benchmark
+        requests = benchmark.build_mix(20)
+        path = tmp_path / 'mix.jsonl'
+        benchmark.save_jsonl(requests, path)
+        assert benchmark.load_jsonl(path) == requests
+        result = bench(requests=benchmark.load_jsonl(path), warmup=0)
+        assert result['total']['requests'] == 20
+
+    @pytest.mark.django_db
+    def test_benchmark_not_rate_limited(self, bench):
+        from posts import benchmark
+        requests = benchmark.build_mix(150, {'api_posts': 1})
+        # все запросы от одного пользователя — больше лимита API в минуту
+        for item in requests:
+            item['user'] = requests[0]['user']
+        result = bench(requests=requests, warmup=0)
+        assert result['total']['errors'] == 0, \
+            'Лимиты частоты не должны влиять на замеры'
@@ -0,0 +1,137 @@
+"""
+ASGI config for yatube project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+В Django 2.2 нет ни ASGI-обработчика, ни асинхронных представлений,
+поэтому WSGI-приложение запускается в ограниченном пуле потоков
+(``ASGI_THREADS``), а всё, что зависит от скорости клиента, остаётся
+в event loop: тело запроса читается до того, как занят поток, обычный
+ответ отдаётся клиенту уже после того, как поток освобождён.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+
+# тела запросов больше этого размера уходят во временный файл
+MAX_MEMORY_BODY = 64 * 1024
+
+
+class WsgiToAsgi:
+    def __init__(self, wsgi_application, max_workers):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported ASGI scope: %s' % scope['type'])
+
+        with SpooledTemporaryFile(max_size=MAX_MEMORY_BODY) as body:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body.write(message.get('body', b''))
+                if not message.get('more_body'):
+                    break
+            body.seek(0)
+            loop = asyncio.get_event_loop()
+            response = await loop.run_in_executor(
+                self.executor, self.run_wsgi, loop,
+                self.build_environ(scope, body), send)
+
+        if response is not None:
+            status, headers, content = response
+            await send({'type': 'http.response.start',
+                        'status': status, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': content})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def run_wsgi(self, loop, environ, send):
+        """Выполняется в потоке пула. Обычный ответ собирается целиком
+        и возвращается в event loop; потоковый отдаётся по частям прямо
+        отсюда — соединение с базой у Django привязано к потоку."""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [
+                (name.lower().encode('latin1'), value.encode('latin1'))
+                for name, value in headers]
+
+        result = self.wsgi_application(environ, start_response)
+        try:
+            if not getattr(result, 'streaming', False):
+                content = b''.join(result)
+                return started['status'], started['headers'], content
+
+            def sync_send(message):
+                asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+            sync_send({'type': 'http.response.start',
+                       'status': started['status'],
+                       'headers': started['headers']})
+            for chunk in result:
+                sync_send({'type': 'http.response.body', 'body': chunk,
+                           'more_body': True})
+            sync_send({'type': 'http.response.body', 'body': b''})
+            return None
+        finally:
+            # здесь срабатывает request_finished и закрывается соединение
+            if hasattr(result, 'close'):
+                result.close()
+
+    @staticmethod
+    def build_environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': BytesIO(),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin1').upper().replace('-', '_')
+            value = value.decode('latin1')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+                continue
+            key = 'HTTP_' + name
+            if key in environ:
+                value = environ[key] + ',' + value
+            environ[key] = value
+        return environ
+
+
+application = WsgiToAsgi(
+    get_wsgi_application(), int(os.environ.get('ASGI_THREADS', 8)))
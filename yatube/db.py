@@ -0,0 +1,41 @@
+"""Настройка соединений с базой.
+
+SQLite: при каждом новом соединении включаются WAL (читатели не ждут
+писателя), `synchronous=NORMAL` (в WAL это безопасно и избавляет от
+fsync на каждом коммите) и отображение файла в память.
+
+Постоянные соединения (`CONN_MAX_AGE`) живут в рабочих потоках и вместе
+образуют пул размером с число потоков. Django 2.2 замечает разорванное
+соединение только после ошибки в запросе, поэтому перед каждым запросом
+постоянные соединения проверяются и неисправные закрываются — Django
+откроет новое при первом обращении.
+"""
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 256 * 1024 * 1024),
+)
+
+
+@receiver(connection_created)
+def sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+@receiver(request_started)
+def check_connections(sender, **kwargs):
+    for connection in connections.all():
+        if (connection.connection is not None
+                and connection.settings_dict['CONN_MAX_AGE']
+                and not connection.in_atomic_block
+                and not connection.is_usable()):
+            connection.close()
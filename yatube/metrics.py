@@ -0,0 +1,247 @@
+"""Метрики производительности запросов.
+
+`MetricsMiddleware` для каждого запроса собирает общее время, число и
+время SQL-запросов, время рендеринга шаблонов и обращения к кэшу,
+помечает их именем URL и складывает в гистограммы процесса.
+`metrics_view` отдаёт их в текстовом формате Prometheus.
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import MemcachedCache
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+# Сколько SQL-запросов держать для лога медленного запроса
+MAX_LOGGED_QUERIES = 100
+
+_local = threading.local()
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Гистограммы и счётчики с меткой `view` в памяти процесса."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.help = {}
+
+    def histogram(self, name, help_text, buckets):
+        self.help[name] = (help_text, 'histogram')
+        self.histograms.setdefault(name, (buckets, {}))
+
+    def counter(self, name, help_text):
+        self.help[name] = (help_text, 'counter')
+
+    def observe(self, name, view, value):
+        buckets, series = self.histograms[name]
+        with self.lock:
+            if view not in series:
+                series[view] = Histogram(buckets)
+            series[view].observe(value)
+
+    def inc(self, name, view, value=1):
+        with self.lock:
+            self.counters[name][view] += value
+
+    def reset(self):
+        with self.lock:
+            for buckets, series in self.histograms.values():
+                series.clear()
+            self.counters.clear()
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (help_text, kind) in sorted(self.help.items()):
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s %s' % (name, kind))
+                if kind == 'counter':
+                    for view, value in sorted(self.counters[name].items()):
+                        lines.append('%s{view="%s"} %s' % (name, view, value))
+                    continue
+                for view, hist in sorted(self.histograms[name][1].items()):
+                    for bound, value in zip(hist.buckets, hist.counts):
+                        lines.append('%s_bucket{view="%s",le="%s"} %d' % (
+                            name, view, bound, value))
+                    lines.append('%s_bucket{view="%s",le="+Inf"} %d' % (
+                        name, view, hist.count))
+                    lines.append('%s_sum{view="%s"} %s' % (
+                        name, view, hist.sum))
+                    lines.append('%s_count{view="%s"} %d' % (
+                        name, view, hist.count))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+registry.histogram(
+    'yatube_request_duration_seconds', 'Время обработки запроса',
+    DURATION_BUCKETS)
+registry.histogram(
+    'yatube_sql_queries', 'Число SQL-запросов на запрос', COUNT_BUCKETS)
+registry.histogram(
+    'yatube_sql_duration_seconds', 'Суммарное время SQL на запрос',
+    DURATION_BUCKETS)
+registry.histogram(
+    'yatube_template_render_seconds', 'Время рендеринга шаблонов на запрос',
+    DURATION_BUCKETS)
+registry.counter('yatube_cache_hits_total', 'Попадания в кэш')
+registry.counter('yatube_cache_misses_total', 'Промахи кэша')
+
+
+class RequestSample:
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0
+        self.queries = []
+        self.template_time = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.sql_count += 1
+            self.sql_time += duration
+            if len(self.queries) < MAX_LOGGED_QUERIES:
+                self.queries.append((duration, sql))
+
+
+def current_sample():
+    return getattr(_local, 'sample', None)
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    # view_name учитывает пространство имён: 'index' и 'admin:index'
+    return match.view_name
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample = _local.sample = RequestSample()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(sample))
+                response = self.get_response(request)
+        finally:
+            _local.sample = None
+        duration = time.perf_counter() - start
+        self.record(request, sample, duration)
+        return response
+
+    def record(self, request, sample, duration):
+        view = view_label(request)
+        registry.observe('yatube_request_duration_seconds', view, duration)
+        registry.observe('yatube_sql_queries', view, sample.sql_count)
+        registry.observe('yatube_sql_duration_seconds', view, sample.sql_time)
+        registry.observe(
+            'yatube_template_render_seconds', view, sample.template_time)
+        registry.inc('yatube_cache_hits_total', view, sample.cache_hits)
+        registry.inc('yatube_cache_misses_total', view, sample.cache_misses)
+
+        slow_ms = getattr(settings, 'METRICS_SLOW_REQUEST_MS', None)
+        if slow_ms is not None and duration * 1000 >= slow_ms:
+            logger.warning(
+                'Slow request %s %s (%s): %.1f ms, %d queries, %.1f ms SQL\n%s',
+                request.method, request.get_full_path(), view,
+                duration * 1000, sample.sql_count, sample.sql_time * 1000,
+                '\n'.join('%8.2f ms  %s' % (query_time * 1000, sql)
+                          for query_time, sql in sample.queries))
+
+
+class TimedTemplate:
+    """Обёртка шаблона, засекающая время `render`."""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            sample = current_sample()
+            if sample is not None:
+                sample.template_time += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class InstrumentedCacheMixin:
+    """Считает попадания и промахи `get` в текущем запросе."""
+    _metrics_missing = object()
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, self._metrics_missing, version)
+        sample = current_sample()
+        if sample is not None:
+            if value is self._metrics_missing:
+                sample.cache_misses += 1
+            else:
+                sample.cache_hits += 1
+        return default if value is self._metrics_missing else value
+
+
+class InstrumentedLocMemCache(InstrumentedCacheMixin, LocMemCache):
+    pass
+
+
+class InstrumentedMemcachedCache(InstrumentedCacheMixin, MemcachedCache):
+    pass
+
+
+def metrics_view(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    authorized = request.user.is_staff or (
+        token and request.META.get('HTTP_AUTHORIZATION') == 'Bearer ' + token)
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type='text/plain; version=0.0.4')
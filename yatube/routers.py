@@ -0,0 +1,74 @@
+"""Чтение с реплик.
+
+`ReplicaRouter` отправляет чтения на одну из реплик из
+`DATABASE_REPLICAS`, а запись — на `default`. Реплики используются
+только внутри GET/HEAD-запросов, которые пометил `ReplicaMiddleware`:
+команды, фоновые задачи и POST-запросы читают с основной базы.
+
+Реплика отстаёт, поэтому после записи пользователь на
+`REPLICA_PIN_SECONDS` секунд закрепляется за основной базой (cookie),
+чтобы сразу увидеть свой пост или комментарий. Если запись случилась
+посреди GET-запроса, его оставшиеся чтения тоже идут на основную базу.
+Так же читаются страницы, чьё поколение кэша моложе
+`REPLICA_PIN_SECONDS` (см. `posts.caching.page_versions`).
+"""
+import random
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'pin_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# отставшая сессия на реплике выглядела бы как выход из аккаунта
+PRIMARY_APPS = {'sessions'}
+
+_local = threading.local()
+
+
+def use_replicas():
+    return getattr(_local, 'replicas', False)
+
+
+def pin_primary():
+    """Оставшиеся чтения текущего запроса идут на основную базу."""
+    _local.replicas = False
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', ())
+        if (not replicas or not use_replicas()
+                or model._meta.app_label in PRIMARY_APPS
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _local.replicas = False
+        _local.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # на репликах те же данные, что и в основной базе
+        return True
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.replicas = (request.method in SAFE_METHODS
+                           and PIN_COOKIE not in request.COOKIES)
+        _local.wrote = False
+        try:
+            response = self.get_response(request)
+            wrote = _local.wrote
+        finally:
+            _local.replicas = _local.wrote = False
+        if wrote:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax')
+        return response
@@ -36,6 +36,7 @@ ALLOWED_HOSTS = [
 # Application definition
 
 INSTALLED_APPS = [
+    'yatube.apps.YatubeConfig',
     'Users',
     'posts',
     'django.contrib.admin',
@@ -55,6 +56,8 @@ INSTALLED_APPS = [
 SITE_ID = 1
 
 MIDDLEWARE = [
+    'yatube.metrics.MetricsMiddleware',
+    'yatube.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -69,7 +72,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'yatube.metrics.InstrumentedDjangoTemplates',
         'DIRS': [
             TEMPLATES_DIR
         ],
@@ -90,14 +93,29 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
+# PostgreSQL — в профиле yatube/settings_production.py. Прагмы SQLite
+# и проверка постоянных соединений — в yatube/db.py
 
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        'OPTIONS': {
+            # сколько секунд писатель ждёт блокировку вместо
+            # немедленного «database is locked»
+            'timeout': 20,
+        },
     }
 }
 
+# Чтение с реплик, см. yatube/routers.py. Реплики — псевдонимы из
+# DATABASES; пустой список — всё читается из default
+DATABASE_ROUTERS = ['yatube.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+# Сколько секунд после записи пользователь читает из основной базы
+REPLICA_PIN_SECONDS = 10
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -149,9 +167,31 @@ LOGOUT_REDIRECT_URL = "index"
 EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
+# Превью картинок постов готовятся в фоне, см. posts/thumbnails.py
+THUMBNAIL_ASYNC = True
+THUMBNAIL_WORKERS = 2
+# 'threads' — пул потоков веб-процесса, 'jobs' — очередь задач в базе
+THUMBNAIL_QUEUE = 'threads'
+
+# Очередь фоновых задач, см. posts/jobs.py (секунды)
+JOB_LEASE_SECONDS = 300
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BASE_SECONDS = 10
+JOB_RETRY_MAX_SECONDS = 3600
+JOB_POLL_SECONDS = 1
+
+# Живая лента новых постов, см. posts/live.py (секунды)
+LIVE_HEARTBEAT = 15
+LIVE_STREAM_SECONDS = 300
+LIVE_POLL_SECONDS = 25
+LIVE_RETRY_MS = 3000
+# Одновременных SSE-потоков и long-poll на процесс: каждый держит
+# рабочий поток сервера (ASGI_THREADS, по умолчанию 8)
+LIVE_MAX_STREAMS = 2
+
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'yatube.metrics.InstrumentedLocMemCache',
     }
 }
 
@@ -161,9 +201,36 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
-    ]
+        'posts.authentication.CachedTokenAuthentication',
+    ],
+
+    'DEFAULT_PAGINATION_CLASS': 'posts.pagination.PostCursorPagination',
+    'PAGE_SIZE': 20,
+
+    'DEFAULT_THROTTLE_CLASSES': [
+        'posts.ratelimit.BucketThrottle',
+    ],
 }
 
+# Сколько секунд токен API с пользователем живёт в кэше,
+# см. posts/authentication.py
+AUTH_TOKEN_CACHE_TIMEOUT = 300
+
+# Лимиты частоты запросов по областям, см. posts/ratelimit.py
+RATE_LIMITS = {
+    'new_post': '10/m',
+    'add_comment': '30/m',
+    'follow': '30/m',
+    'live_posts': '30/m',
+    'api': '120/m',
+    'api_bulk': '10/m',
+    'api_token': '10/m',
+}
+
+# Метрики производительности, см. yatube/metrics.py
+METRICS_SLOW_REQUEST_MS = 500
+# Токен для сборщика метрик без входа в админку (Authorization: Bearer ...)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_URLS_REGEX = r'^/api/.*$'
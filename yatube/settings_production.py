@@ -0,0 +1,64 @@
+"""
+Продакшен-профиль: ``DJANGO_SETTINGS_MODULE=yatube.settings_production``.
+
+PostgreSQL с постоянными соединениями; параметры берутся из окружения.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+
+DEBUG = os.environ.get('DJANGO_DEBUG') == '1'
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost').split(',')
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'yatube'),
+        'USER': os.environ.get('POSTGRES_USER', 'yatube'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        # соединение живёт в рабочем потоке и переиспользуется запросами;
+        # перед запросом его проверяет yatube.db.check_connections
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 300)),
+        'OPTIONS': {
+            'connect_timeout': 5,
+            # TCP keepalive: разрыв соединения за балансировщиком
+            # обнаруживается, даже пока поток простаивает
+            'keepalives': 1,
+            'keepalives_idle': 60,
+            'keepalives_interval': 10,
+            'keepalives_count': 3,
+        },
+    }
+}
+
+# Общий для всех процессов кэш: через него расходятся поколения кэша
+# страниц и ETag, корзины лимитов частоты, сброс кэша токенов и версия
+# справочника групп. Кэш в памяти процесса здесь не годится.
+# MEMCACHED_LOCATION=host1:11211,host2:11211
+CACHES = {
+    'default': {
+        'BACKEND': 'yatube.metrics.InstrumentedMemcachedCache',
+        'LOCATION': os.environ.get(
+            'MEMCACHED_LOCATION', '127.0.0.1:11211').split(','),
+    }
+}
+
+# Реплики для чтения: POSTGRES_REPLICA_HOSTS=host1,host2
+for index, host in enumerate(filter(None, os.environ.get(
+        'POSTGRES_REPLICA_HOSTS', '').split(','))):
+    DATABASES['replica%d' % index] = dict(
+        DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+# превью готовит manage.py run_worker, а не потоки веб-процесса
+THUMBNAIL_QUEUE = os.environ.get('THUMBNAIL_QUEUE', 'jobs')
+
+# Число своих прокси перед приложением: только тогда лимиты частоты
+# берут адрес клиента из X-Forwarded-For, см. posts/ratelimit.py
+if os.environ.get('DJANGO_NUM_PROXIES'):
+    REST_FRAMEWORK = dict(  # noqa: F405
+        REST_FRAMEWORK,  # noqa: F405
+        NUM_PROXIES=int(os.environ['DJANGO_NUM_PROXIES']))
@@ -21,11 +21,14 @@ from django.conf.urls import handler404, handler500
 from django.conf import settings
 from django.conf.urls.static import static
 
+from .metrics import metrics_view
+
 handler404 = "posts.views.page_not_found"
 # handler500 = "posts.views.server_error"
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     re_path(r'^favicon\.ico$', RedirectView.as_view(
         url='static/favicon.ico'), name='favicon'),
     path("auth/", include("Users.urls")),